@@ -1,13 +1,16 @@
 """The Skyline integration."""
 from __future__ import annotations
 
+import json
 import logging
 
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
 from homeassistant.core import HomeAssistant
 
 from .const import DOMAIN, PLATFORMS
 from .controller import Controller
+from .view import SkylineMetricsView
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -27,9 +30,40 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     if "clickhouse_url" in entry.data:
         controller.clickhouse_url = entry.data["clickhouse_url"]
 
+    if "stats_mode" in entry.data:
+        controller.stats_mode = entry.data["stats_mode"]
+
+    if "local_stats" in entry.data:
+        controller.local_stats = entry.data["local_stats"]
+
+    if "influx_url" in entry.data:
+        controller.influx_url = entry.data["influx_url"]
+
+    if "influx_token" in entry.data:
+        controller.influx_token = entry.data["influx_token"]
+
+    if "stats_file" in entry.data:
+        controller.stats_file = entry.data["stats_file"]
+
+    if "pushgateway_url" in entry.data:
+        controller.pushgateway_url = entry.data["pushgateway_url"]
+
     hass.data[DOMAIN]["controller"] = controller
+
+    if "metrics_view" not in hass.data[DOMAIN]:
+        # Views can't be unregistered, so the one view serves whichever controller is current.
+        hass.data[DOMAIN]["metrics_view"] = SkylineMetricsView(hass)
+        hass.http.register_view(hass.data[DOMAIN]["metrics_view"])
     await controller.initialise()
 
+    async def handle_stop(event):
+        # Entries aren't unloaded when HA stops, so write out buffered stats here too.
+        await controller.async_terminate()
+
+    entry.async_on_unload(
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, handle_stop)
+    )
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     return True
@@ -87,6 +121,14 @@ def setup(hass: HomeAssistant, entry: ConfigEntry):
 
     hass.services.register(DOMAIN, "set_excess_params", handle_set_setpoint)
 
+    def handle_dump_modbus_stats(call):
+        controller = hass.data[DOMAIN]["controller"]
+        _LOGGER.warning(
+            "Skyline modbus stats: %s", json.dumps(controller.modbus_stats(), indent=2)
+        )
+
+    hass.services.register(DOMAIN, "dump_modbus_stats", handle_dump_modbus_stats)
+
     _LOGGER.info("Registered Inverter services")
 
     return True
@@ -96,7 +138,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
 
     if hass.data[DOMAIN]["controller"] is not None:
-        hass.data[DOMAIN]["controller"].terminate()
+        await hass.data[DOMAIN]["controller"].async_terminate()
 
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
@@ -0,0 +1,245 @@
+"""Rolling aggregates of recent samples."""
+
+from array import array
+from collections import deque
+from math import fsum
+import time
+
+
+class RollingAggregate:
+    """A ring buffer of timestamped samples with running totals.
+
+    Inserting a sample and fetching the average of the whole window are O(1). With
+    retain_seconds set, samples are kept for that long on the wall clock and the
+    buffer grows if needed, otherwise the oldest sample is overwritten once full.
+    Running min / max are optional as they cost a little extra per insert.
+    """
+
+    def __init__(
+        self, capacity: int, track_extremes=False, retain_seconds=None
+    ) -> None:
+        """Rolling aggregate initialiser."""
+        self._capacity = max(int(capacity), 2)
+        self._values = array("d", bytes(8 * self._capacity))
+        self._times = array("d", bytes(8 * self._capacity))
+        self._start = 0
+        self._count = 0
+        self._sum = float(0)
+        self._sum_squares = float(0)
+        self._area = float(0)
+        self._inserts = 0
+        self._minimums = deque() if track_extremes else None
+        self._maximums = deque() if track_extremes else None
+        self.retain_seconds = retain_seconds
+
+    @property
+    def capacity(self) -> int:
+        """The number of samples held before the buffer wraps or grows."""
+        return self._capacity
+
+    def __len__(self) -> int:
+        """The number of samples held."""
+        return self._count
+
+    def __iter__(self):
+        """Iterate the samples from oldest to newest."""
+        for i in range(self._count):
+            yield self._values[(self._start + i) % self._capacity]
+
+    def _value(self, i: int) -> float:
+        return self._values[(self._start + i) % self._capacity]
+
+    def _time(self, i: int) -> float:
+        return self._times[(self._start + i) % self._capacity]
+
+    def _segment(self, i: int) -> float:
+        """The trapezoid area between sample i and the one after it."""
+        return (
+            (self._time(i + 1) - self._time(i))
+            * (self._value(i) + self._value(i + 1))
+            / 2
+        )
+
+    def _evict_oldest(self) -> None:
+        if self._count > 1:
+            self._area = self._area - self._segment(0)
+
+        oldest = self._values[self._start]
+        self._sum = self._sum - oldest
+        self._sum_squares = self._sum_squares - oldest * oldest
+        self._start = (self._start + 1) % self._capacity
+        self._count = self._count - 1
+
+    def append(self, value, at=None) -> None:
+        """Add a sample taken at a monotonic time, discarding samples no longer needed."""
+        value = float(value)
+        at = time.monotonic() if at is None else float(at)
+
+        if self.retain_seconds is not None:
+            # keep one sample at or before the start of the window to interpolate from.
+            while self._count > 1 and self._time(1) <= at - self.retain_seconds:
+                self._evict_oldest()
+
+        if self._count == self._capacity:
+            if self.retain_seconds is not None:
+                self.resize(self._capacity * 2)
+            else:
+                self._evict_oldest()
+
+        if self._count > 0:
+            last = self._count - 1
+            self._area = (
+                self._area + (at - self._time(last)) * (self._value(last) + value) / 2
+            )
+
+        index = (self._start + self._count) % self._capacity
+        self._values[index] = value
+        self._times[index] = at
+        self._count = self._count + 1
+
+        self._sum = self._sum + value
+        self._sum_squares = self._sum_squares + value * value
+        self._inserts = self._inserts + 1
+
+        if self._inserts % self._capacity == 0:
+            # re-sum now and then so floating point error can't accumulate.
+            self._sum = fsum(self)
+            self._sum_squares = fsum(x * x for x in self)
+            self._area = fsum(self._segment(i) for i in range(self._count - 1))
+
+        if self._minimums is not None:
+            while len(self._minimums) > 0 and self._minimums[-1][1] >= value:
+                self._minimums.pop()
+            while len(self._maximums) > 0 and self._maximums[-1][1] <= value:
+                self._maximums.pop()
+
+            self._minimums.append((self._inserts, value))
+            self._maximums.append((self._inserts, value))
+
+            oldest_kept = self._inserts - self._count
+            while self._minimums[0][0] <= oldest_kept:
+                self._minimums.popleft()
+            while self._maximums[0][0] <= oldest_kept:
+                self._maximums.popleft()
+
+    def resize(self, capacity: int) -> None:
+        """Change the capacity, keeping the newest samples."""
+        capacity = max(int(capacity), 2)
+        samples = [
+            (self._value(i), self._time(i))
+            for i in range(max(self._count - capacity, 0), self._count)
+        ]
+        self.__init__(
+            capacity,
+            track_extremes=self._minimums is not None,
+            retain_seconds=self.retain_seconds,
+        )
+        for value, at in samples:
+            self.append(value, at)
+
+    def average(self, count=0) -> float:
+        """Average the newest count samples, or all samples if count is zero."""
+        if self._count == 0:
+            raise ValueError("No samples to average")
+
+        if count <= 0 or count >= self._count:
+            return self._sum / self._count
+
+        total = float(0)
+        for i in range(self._count - count, self._count):
+            total = total + self._value(i)
+        return total / count
+
+    @property
+    def span(self) -> float:
+        """The seconds between the oldest and newest samples."""
+        if self._count == 0:
+            return float(0)
+        return self._time(self._count - 1) - self._time(0)
+
+    def time_weighted_average(self, window_seconds=0) -> float:
+        """Average over the window ending at the newest sample, weighting samples by time.
+
+        Values are linearly interpolated between samples (the trapezoidal rule), so
+        late or missed samples don't skew the average. A window of zero covers every
+        sample held.
+        """
+        if self._count == 0:
+            raise ValueError("No samples to average")
+
+        newest = self._time(self._count - 1)
+        oldest = self._time(0)
+        start = newest - window_seconds if window_seconds > 0 else oldest
+
+        if newest - max(start, oldest) <= 0:
+            return self._value(self._count - 1)
+
+        if start <= oldest:
+            return self._area / (newest - oldest)
+
+        if newest - start > self.span / 2:
+            # most of the buffer is in the window, take off the part before it.
+            area = self._area
+            i = 0
+            while self._time(i + 1) <= start:
+                area = area - self._segment(i)
+                i = i + 1
+            if self._time(i) < start:
+                t0 = self._time(i)
+                v0 = self._value(i)
+                v_start = v0 + (self._value(i + 1) - v0) * (start - t0) / (
+                    self._time(i + 1) - t0
+                )
+                area = area - (start - t0) * (v0 + v_start) / 2
+        else:
+            area = float(0)
+            i = self._count - 1
+            while self._time(i - 1) >= start:
+                area = area + self._segment(i - 1)
+                i = i - 1
+            if self._time(i) > start:
+                t1 = self._time(i)
+                v1 = self._value(i)
+                v_start = v1 - (v1 - self._value(i - 1)) * (t1 - start) / (
+                    t1 - self._time(i - 1)
+                )
+                area = area + (t1 - start) * (v_start + v1) / 2
+
+        return area / (newest - start)
+
+    def samples_since(self, seconds: float):
+        """Iterate the values of samples within the given seconds of the newest."""
+        if self._count == 0:
+            return
+        start = self._time(self._count - 1) - seconds
+        for i in range(self._count):
+            if self._time(i) >= start:
+                yield self._value(i)
+
+    @property
+    def total(self) -> float:
+        """The sum of all samples."""
+        return self._sum
+
+    @property
+    def variance(self) -> float:
+        """The population variance of all samples."""
+        if self._count == 0:
+            return float(0)
+        mean = self._sum / self._count
+        return max(self._sum_squares / self._count - mean * mean, float(0))
+
+    @property
+    def minimum(self) -> float | None:
+        """The smallest sample, if extremes are tracked."""
+        if self._minimums is None or len(self._minimums) == 0:
+            return None
+        return self._minimums[0][1]
+
+    @property
+    def maximum(self) -> float | None:
+        """The largest sample, if extremes are tracked."""
+        if self._maximums is None or len(self._maximums) == 0:
+            return None
+        return self._maximums[0][1]
+
@@ -109,4 +109,4 @@ class InverterBinarySensorEntity(BinarySensorEntity):
         self._attr_is_on = newValue
         self.currentValue = newValue
 
-        self._async_write_ha_state()
+        self.controller.schedule_state_write(self)
@@ -14,7 +14,15 @@ from homeassistant.core import HomeAssistant
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    INVERTER_POLL_INTERVAL_SECONDS,
+    MODBUS_MAX_SLAVE_ADDRESS,
+    SENSOR_DEADBANDS,
+    SENSOR_HEARTBEAT_SECONDS,
+    STATS_MODE_CHANGES,
+    STATS_MODE_WIDE,
+)
 
 _LOGGER = logging.getLogger(__name__)
 STEP_USER_DATA_SCHEMA = vol.Schema(
@@ -202,6 +210,67 @@ class OptionsFlowHandler(OptionsFlow):
         excess_load_percentage = 100
         if "excess_load_percentage" in self.config_entry.data:
             excess_load_percentage = self.config_entry.data["excess_load_percentage"]
+
+        poll_interval_seconds = INVERTER_POLL_INTERVAL_SECONDS
+        if "poll_interval_seconds" in self.config_entry.data:
+            poll_interval_seconds = self.config_entry.data["poll_interval_seconds"]
+
+        stats_mode = STATS_MODE_WIDE
+        if "stats_mode" in self.config_entry.data:
+            stats_mode = self.config_entry.data["stats_mode"]
+
+        local_stats = False
+        if "local_stats" in self.config_entry.data:
+            local_stats = self.config_entry.data["local_stats"]
+
+        influx_url = ""
+        if "influx_url" in self.config_entry.data:
+            influx_url = self.config_entry.data["influx_url"]
+
+        influx_token = ""
+        if "influx_token" in self.config_entry.data:
+            influx_token = self.config_entry.data["influx_token"]
+
+        stats_file = False
+        if "stats_file" in self.config_entry.data:
+            stats_file = self.config_entry.data["stats_file"]
+
+        pushgateway_url = ""
+        if "pushgateway_url" in self.config_entry.data:
+            pushgateway_url = self.config_entry.data["pushgateway_url"]
+
+        min_publish_interval_seconds = 0
+        if "min_publish_interval_seconds" in self.config_entry.data:
+            min_publish_interval_seconds = self.config_entry.data[
+                "min_publish_interval_seconds"
+            ]
+
+        sensor_heartbeat_seconds = SENSOR_HEARTBEAT_SECONDS
+        if "sensor_heartbeat_seconds" in self.config_entry.data:
+            sensor_heartbeat_seconds = self.config_entry.data[
+                "sensor_heartbeat_seconds"
+            ]
+
+        deadbands = {}
+        for device_class, (absolute, percent) in SENSOR_DEADBANDS.items():
+            key = device_class + "_deadband"
+            deadbands[
+                vol.Optional(key, default=self.config_entry.data.get(key, absolute))
+            ] = vol.All(vol.Coerce(float), vol.Range(min=0))
+            deadbands[
+                vol.Optional(
+                    key + "_percent",
+                    default=self.config_entry.data.get(key + "_percent", percent),
+                )
+            ] = vol.All(vol.Coerce(float), vol.Range(min=0))
+
+        max_slave_address = MODBUS_MAX_SLAVE_ADDRESS
+        if "max_slave_address" in self.config_entry.data:
+            max_slave_address = self.config_entry.data["max_slave_address"]
+
+        modbus_pipeline_depth = 1
+        if "modbus_pipeline_depth" in self.config_entry.data:
+            modbus_pipeline_depth = self.config_entry.data["modbus_pipeline_depth"]
         return self.async_show_form(
             step_id="init",
             data_schema=vol.Schema(
@@ -222,6 +291,31 @@ class OptionsFlowHandler(OptionsFlow):
                     vol.Optional(
                         "excess_load_entity_id", default=excess_load_entity_id
                     ): str,
+                    vol.Optional(
+                        "poll_interval_seconds", default=poll_interval_seconds
+                    ): int,
+                    vol.Optional(
+                        "min_publish_interval_seconds",
+                        default=min_publish_interval_seconds,
+                    ): int,
+                    vol.Optional(
+                        "sensor_heartbeat_seconds", default=sensor_heartbeat_seconds
+                    ): int,
+                    **deadbands,
+                    vol.Optional(
+                        "max_slave_address", default=max_slave_address
+                    ): vol.All(int, vol.Range(min=1, max=247)),
+                    vol.Optional(
+                        "modbus_pipeline_depth", default=modbus_pipeline_depth
+                    ): vol.All(int, vol.Range(min=1, max=16)),
+                    vol.Optional("stats_mode", default=stats_mode): vol.In(
+                        [STATS_MODE_WIDE, STATS_MODE_CHANGES]
+                    ),
+                    vol.Optional("local_stats", default=local_stats): bool,
+                    vol.Optional("influx_url", default=influx_url): str,
+                    vol.Optional("influx_token", default=influx_token): str,
+                    vol.Optional("stats_file", default=stats_file): bool,
+                    vol.Optional("pushgateway_url", default=pushgateway_url): str,
                 }
             ),
             errors=errors,
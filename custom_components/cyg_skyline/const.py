@@ -3,10 +3,50 @@
 from homeassistant.const import Platform
 
 DOMAIN = "cyg_skyline"
-INVERTER_POLL_INTERVAL_SECONDS = 10
+INVERTER_POLL_INTERVAL_SECONDS = 10  # Default interval for power registers, others are polled less often.
+ENERGY_POLL_INTERVAL_SECONDS = 30
+CONFIG_POLL_INTERVAL_SECONDS = 60
+VERSION_POLL_INTERVAL_SECONDS = 7200
 IMPORT_EXPORT_MONITOR_DURATION_SECONDS = 120
 IMPORT_EXPORT_THRESHOLD = 0.1
+POLL_HOSTS_CONCURRENTLY = True  # Each modbus adapter has its own bus so can be polled alongside the others.
 MODBUS_MAX_SLAVE_ADDRESS = 1  # Stops us wasting time because Skyline doesn't let you change the slave address on parallel systems.
+MODBUS_MAX_READ_REGISTERS = 125  # Modbus PDU limit for a single read holding registers request.
+MODBUS_MAX_WRITE_REGISTERS = 123  # Modbus PDU limit for a single write multiple registers request.
+MODBUS_WRITE_COALESCE_SECONDS = 0.25  # Settings are written once they've been left alone this long.
+MODBUS_WRITE_DEBOUNCE_MAX_SECONDS = 2  # Longest a setting that keeps changing holds its write back.
+MODBUS_READ_GAP_TOLERANCE = 32  # Unused registers we'll read through to merge two reads into one.
+MODBUS_REQUEST_TIMEOUT_SECONDS = 3  # An adapter that hasn't answered by now has gone away.
+MODBUS_CONNECT_TIMEOUT_SECONDS = 5
+MODBUS_RECONNECT_MIN_SECONDS = 1
+MODBUS_RECONNECT_MAX_SECONDS = 60
+MODBUS_DISCOVERY_DEADLINE_SECONDS = 45  # Per host, hosts are scanned together so startup waits at most this long.
+MODBUS_PROBE_TIMEOUT_SECONDS = 1  # Long enough for a gateway to give up on the slave before us.
+MODBUS_SCAN_MAX_MISSES = 3  # Consecutive empty slave addresses before a scan stops.
+TOPOLOGY_SAVE_DELAY_SECONDS = 10  # So versions read from several inverters are saved together.
+STATS_SINK_BATCH_ROWS = 30  # Rows per write, so clickhouse isn't left merging lots of tiny parts.
+STATS_SINK_FLUSH_INTERVAL_SECONDS = 300
+STATS_SINK_MAX_BUFFERED_ROWS = 8640  # A day of rows at the default poll interval, oldest dropped beyond this.
+STATS_SINK_SHUTDOWN_SECONDS = 10  # Time allowed to write out buffered rows when stopping.
+CLICKHOUSE_REPLAY_BATCH_ROWS = 1000  # Rows per insert when catching up from the spool.
+STATS_SPOOL_MAX_BYTES = 64 * 1024 * 1024  # Oldest spooled rows are dropped beyond this.
+STATS_SPOOL_SEGMENT_BYTES = 1024 * 1024
+STATS_MODE_WIDE = "wide"  # A row per poll with a column per sensor.
+STATS_MODE_CHANGES = "changes"  # A row per changed value, with periodic keyframes.
+STATS_KEYFRAME_INTERVAL_SECONDS = 3600
+LOCAL_STATS_RAW_RETENTION_DAYS = 7  # Raw rows are kept in a table per day, older days are dropped.
+LOCAL_STATS_ROLLUP_SECONDS = [60, 900, 3600]
+LOCAL_STATS_ROLLUP_RETENTION_DAYS = 90  # For the finest rollup only, the others are kept.
+SENSOR_DEADBANDS = {
+    # device class: (absolute, percent of the last value published), the larger applies.
+    # Changes within the deadband aren't published until the heartbeat is due. Each is
+    # an option, "<device class>_deadband" and "<device class>_deadband_percent".
+    "power": (0.01, 1),
+    "voltage": (0.5, 0),
+    "current": (0.1, 0),
+    "temperature": (0.5, 0),
+}
+SENSOR_HEARTBEAT_SECONDS = 300
 PLATFORMS: list[Platform] = [
     Platform.BINARY_SENSOR,
     Platform.NUMBER,
@@ -3,24 +3,72 @@ import asyncio
 import contextlib
 import logging
 import math
-import struct
 import time
 
-from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.storage import Store
 
+from .aggregate import RollingAggregate
 from .const import (
+    CONFIG_POLL_INTERVAL_SECONDS,
+    DOMAIN,
+    ENERGY_POLL_INTERVAL_SECONDS,
     IMPORT_EXPORT_MONITOR_DURATION_SECONDS,
     IMPORT_EXPORT_THRESHOLD,
     INVERTER_POLL_INTERVAL_SECONDS,
     MAX_GRID_EXPORT_POWER_W,
+    MODBUS_DISCOVERY_DEADLINE_SECONDS,
     MODBUS_MAX_SLAVE_ADDRESS,
+    MODBUS_SCAN_MAX_MISSES,
+    MODBUS_WRITE_COALESCE_SECONDS,
+    MODBUS_WRITE_DEBOUNCE_MAX_SECONDS,
     NO_AGGREGATION,
     PLATFORMS,
+    POLL_HOSTS_CONCURRENTLY,
+    SENSOR_DEADBANDS,
+    SENSOR_HEARTBEAT_SECONDS,
+    STATS_KEYFRAME_INTERVAL_SECONDS,
+    STATS_MODE_CHANGES,
+    STATS_MODE_WIDE,
+    STATS_SPOOL_MAX_BYTES,
+    STATS_SPOOL_SEGMENT_BYTES,
+    TOPOLOGY_SAVE_DELAY_SECONDS,
+    VERSION_POLL_INTERVAL_SECONDS,
 )
 from .inverter import Inverter, ModbusHost
+from .local_stats import SqliteStatsWriter
+from .metrics import (
+    COUNTER,
+    GATEWAY_EXCEPTION_CODES,
+    GAUGE,
+    INFO,
+    Histogram,
+    OpenMetricsBuffer,
+)
+from .registers import (
+    CONFIG,
+    ENERGY,
+    INVERTER_REGISTERS,
+    NUMBER,
+    POWER,
+    SELECT,
+    SENSOR,
+    SWITCH,
+    VERSION,
+    registers_to_string,
+)
+from .schema import ChangesSchema, StatsSchema, column_type
+from .spool import StatsSpool
+from .stats import (
+    ChangeTracker,
+    ClickhouseWriter,
+    FileSink,
+    InfluxSink,
+    PushgatewaySink,
+    StatsPipeline,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +85,22 @@ class Controller:
         self.hass = hass
         self.config = entry
         self.poller_task = None
+        self._write_task = None
+        self._last_write_queued = 0.0
+        self._poll_lock = asyncio.Lock()
+        self._revalidate_topology = False
+        self.topology_store = Store(hass, 1, DOMAIN + "_topology_" + entry.entry_id)
+        self.poll_durations = Histogram()
+        self.poll_overruns = 0
+        self.zero_guard_hits = 0
+        self._poll_depth = 0
+        self._dirty_entities = {}
+        self._last_state_write = {}
+        self.min_publish_interval_seconds = 0
+        self.sensor_heartbeat_seconds = SENSOR_HEARTBEAT_SECONDS
+        self.sensor_deadbands = dict(SENSOR_DEADBANDS)
+        self.modbus_pipeline_depth = 1
+        self.max_slave_address = MODBUS_MAX_SLAVE_ADDRESS
         self.have_identity_info = False
 
         self.sensor_entities = {}
@@ -47,15 +111,30 @@ class Controller:
         self.binary_sensor_entities = {}
         self._init_count = 0
         self.aggregates = {}
+        self._publishers = {}
         self.inverters = []
         self.clickhouse_url = ""
-        self.clickhouse_is_init = True
-        self.aio_http_session = None
+        self.clickhouse_writer = None
+        self.stats_mode = STATS_MODE_WIDE
+        self.local_stats = False
+        self.influx_url = ""
+        self.influx_token = ""
+        self.stats_file = False
+        self.pushgateway_url = ""
+        self.stats = StatsPipeline()
+        self.exposition = OpenMetricsBuffer()
         self.match_feed_in_to_excess_power = False
         self.last_feed_in_sync = time.time()
         self.last_feed_in_poll = time.time()
         self.last_excess = -1
         self.current_state_of_charge = -1
+        self.work_mode = -1
+        self.group_intervals = {
+            POWER: INVERTER_POLL_INTERVAL_SECONDS,
+            ENERGY: ENERGY_POLL_INTERVAL_SECONDS,
+            CONFIG: CONFIG_POLL_INTERVAL_SECONDS,
+            VERSION: VERSION_POLL_INTERVAL_SECONDS,
+        }
         self.excess_target_soc = 90
         self.excess_rate_soc = 0.3
         self.excess_min_feed_in_rate = 0
@@ -97,6 +176,34 @@ class Controller:
                 self.excess_target_soc,
             )
 
+        if "max_slave_address" in entry.data:
+            self.max_slave_address = min(
+                max(int(entry.data["max_slave_address"]), 1), 247
+            )
+
+        if "modbus_pipeline_depth" in entry.data:
+            self.modbus_pipeline_depth = max(int(entry.data["modbus_pipeline_depth"]), 1)
+
+        if "sensor_heartbeat_seconds" in entry.data:
+            self.sensor_heartbeat_seconds = int(entry.data["sensor_heartbeat_seconds"])
+
+        for device_class, (absolute, percent) in SENSOR_DEADBANDS.items():
+            key = device_class + "_deadband"
+            self.sensor_deadbands[device_class] = (
+                max(float(entry.data.get(key, absolute)), 0),
+                max(float(entry.data.get(key + "_percent", percent)), 0),
+            )
+
+        if "min_publish_interval_seconds" in entry.data:
+            self.min_publish_interval_seconds = max(
+                int(entry.data["min_publish_interval_seconds"]), 0
+            )
+
+        if "poll_interval_seconds" in entry.data:
+            self.group_intervals[POWER] = max(
+                int(entry.data["poll_interval_seconds"]), 1
+            )
+
         if "excess_rate_soc" in entry.data:
             self.excess_rate_soc = float(entry.data["excess_rate_soc"]) / 10
 
@@ -135,54 +242,50 @@ class Controller:
         self,
         name: str,
         value,
-        count: int,
-        trimTo=-1,
+        period_seconds: float,
+        retain_seconds=-1,
         always_aggregate=False,
         fetch_only=False,
         insert_only=False,
     ):
-        """Stash a value to an aggregate array and return the average."""
+        """Stash a timestamped value and return the time weighted average over the period."""
 
         if insert_only is True or fetch_only is False:
-            if trimTo == -1:
-                trimTo = count
+            if retain_seconds == -1:
+                retain_seconds = period_seconds
 
             if name not in self.aggregates:
-                self.aggregates[name] = []
-
-            while len(self.aggregates[name]) >= trimTo:
-                self.aggregates[name].pop(0)
+                self.aggregates[name] = RollingAggregate(
+                    math.ceil(retain_seconds / INVERTER_POLL_INTERVAL_SECONDS) + 2,
+                    retain_seconds=retain_seconds,
+                )
+            else:
+                self.aggregates[name].retain_seconds = retain_seconds
 
-            self.aggregates[name].append(value)
+            self.aggregates[name].append(value, time.monotonic())
 
         if insert_only is True:
             return
 
-        t = 0
-        num = 0
-        for v in self.aggregates[name]:
-            t = t + v
-            num = num + 1
-            if num == count:
-                break
-
         if NO_AGGREGATION is True and always_aggregate is False:
             return value
 
-        return t / num
+        return self.aggregates[name].time_weighted_average(period_seconds)
 
     def am_exporting_importing(self, inverter: Inverter, is_import: bool) -> bool:
         """Determine if we're importing or exporting."""
-        minCount = math.ceil(
-            IMPORT_EXPORT_MONITOR_DURATION_SECONDS / INVERTER_POLL_INTERVAL_SECONDS
-        )
+        grid_load = self.aggregates[inverter.serial_number + "_grid_load"]
 
-        if len(self.aggregates[inverter.serial_number + "_grid_load"]) < minCount:
+        # Only decide once we have samples spanning the whole monitoring period.
+        if (
+            grid_load.span
+            < IMPORT_EXPORT_MONITOR_DURATION_SECONDS - self.group_intervals[POWER] / 2
+        ):
             return False
 
         vals = ""
 
-        for v in self.aggregates[inverter.serial_number + "_grid_load"]:
+        for v in grid_load.samples_since(IMPORT_EXPORT_MONITOR_DURATION_SECONDS):
             if len(vals) > 0:
                 vals = vals + ","
             vals = vals + str(v)
@@ -205,12 +308,30 @@ class Controller:
         """Start the async polling of inverter data."""
 
         async def periodic():
+            # Fixed rate, anchored to the monotonic clock so poll duration doesn't add drift.
+            interval = self.group_intervals[POWER]
+            next_poll = (
+                time.monotonic() + interval
+            )  # first because we polled it in await after init.
             while True:
+                await asyncio.sleep(max(next_poll - time.monotonic(), 0))
                 _LOGGER.debug("Polling Inverter Modbus")
-                await asyncio.sleep(
-                    INVERTER_POLL_INTERVAL_SECONDS
-                )  # first because we polled it in await after init.
+                started = time.monotonic()
                 await self.poll_inverters()
+                finished = time.monotonic()
+
+                next_poll = next_poll + interval
+                if finished > next_poll:
+                    # Skip the cycles we've overrun rather than polling back to back.
+                    missed = math.floor((finished - next_poll) / interval) + 1
+                    next_poll = next_poll + missed * interval
+                    self.poll_overruns = self.poll_overruns + missed
+                    _LOGGER.debug(
+                        "Poll took %ss so skipped %s cycles", finished - started, missed
+                    )
+
+                self.poll_durations.observe(finished - started)
+                self.publish_poll_stats()
 
         task = self.config.async_create_background_task(
             self.hass, periodic(), "Skyline Inverter Poll"
@@ -218,345 +339,91 @@ class Controller:
 
         self.poller_task = task
 
-    async def poll_inverters(self):
-        """Poll all inverters."""
-        skyline_pv_power = float(0)
-        skyline_battery_load = float(0)
-        skyline_grid_load = float(0)
-        skyline_grid_tied_load = float(0)
-        skyline_eps_load = float(0)
-        skyline_inverter_load = float(0)
+    def publish_poll_stats(self):
+        """Publish poll loop timing to the diagnostic sensors."""
+        if "skyline_poll_cycle_duration" not in self.sensor_entities:
+            return
 
-        work_mode = -1
+        self.sensor_entities["skyline_poll_cycle_duration"].set_native_value(
+            round(self.poll_durations.last, 2), self.poll_durations.as_dict()
+        )
+        self.sensor_entities["skyline_poll_overruns"].set_native_value(
+            self.poll_overruns
+        )
 
-        for inverter in self.inverters:
+    async def poll_inverters(self):
+        """Poll all inverters, writing the states of changed entities together once done."""
+        async with self._poll_lock:
+            self._poll_depth = self._poll_depth + 1
             try:
-                await inverter.update_software_versions()
-                inverter_power_data = await inverter.read_holding_registers(0x1001, 64)
-                grid_power_data = await inverter.read_holding_registers(0x1300, 63)
-                battery_data = await inverter.read_holding_registers(0x2000, 19)
-                inverter_config_data = await inverter.read_holding_registers(0x2100, 34)
-                grid_config_data = await inverter.read_holding_registers(0x30B0, 12)
-                eps_data = await inverter.read_holding_registers(0x1350, 19)
-
-                if (
-                    inverter_power_data is None
-                    or grid_power_data is None
-                    or battery_data is None
-                    or inverter_config_data is None
-                    or grid_power_data.isError()
-                    or battery_data.isError()
-                    or inverter_config_data.isError()
-                    or inverter_power_data.registers is None
-                    or grid_power_data.registers is None
-                    or battery_data.registers is None
-                    or inverter_config_data.registers is None
-                    or len(inverter_power_data.registers) < 64
-                    or len(grid_power_data.registers) < 63
-                    or len(battery_data.registers) < 19
-                    or len(inverter_config_data.registers) < 34
-                    or len(grid_config_data.registers) < 12
-                    or len(eps_data.registers) < 19
-                ):
-                    _LOGGER.error(
-                        "Skyline Inverter did not provide all results at host %s",
-                        self.host,
-                    )
-                    return
-
-                # if grid and battery totals are zero, smell a mis-report
-                if (
-                    registers_to_unsigned_32(grid_power_data.registers, 6) == 0
-                    and registers_to_unsigned_32(grid_power_data.registers, 8) == 0
-                    and registers_to_unsigned_32(battery_data.registers, 13) == 0
-                    and registers_to_unsigned_32(battery_data.registers, 17) == 0
-                ):
-                    _LOGGER.error(
-                        "Skyline Inverter provided too many zero registers at host %s",
-                        self.host,
-                    )
-                    return
-
-                self.sensor_entities[inverter.serial_number + "_soc"].set_native_value(
-                    battery_data.registers[0]
-                )
-
-                self.current_state_of_charge = battery_data.registers[0]
-
-                inverter_pv_power = (
-                    registers_to_unsigned_32(inverter_power_data.registers, 17)
-                    + registers_to_unsigned_32(inverter_power_data.registers, 21)
-                ) / 10000
-
-                skyline_pv_power = skyline_pv_power + inverter_pv_power
-
-                self.sensor_entities[
-                    inverter.serial_number + "_pv_power"
-                ].set_native_value(
-                    round(
-                        inverter_pv_power,
-                        1,
-                    )
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt1_power"
-                ].set_native_value(
-                    registers_to_unsigned_32(inverter_power_data.registers, 17) / 10000
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt2_power"
-                ].set_native_value(
-                    registers_to_unsigned_32(inverter_power_data.registers, 21) / 10000
-                )
-
-                inverter_battery_load = (
-                    registers_to_signed_32(battery_data.registers, 9) / 10000
-                )
-                skyline_battery_load = skyline_battery_load + inverter_battery_load
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_load"
-                ].set_native_value(inverter_battery_load)
-
-                inverter_grid_load = (
-                    registers_to_signed_32(grid_power_data.registers, 0) / 10000
-                )
-                skyline_grid_load = skyline_grid_load + inverter_grid_load
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_load"
-                ].set_native_value(
-                    round(
-                        self.aggregate(
-                            inverter.serial_number + "_grid_load",
-                            inverter_grid_load,
-                            math.ceil(30 / INVERTER_POLL_INTERVAL_SECONDS),
-                            trimTo=math.ceil(
-                                IMPORT_EXPORT_MONITOR_DURATION_SECONDS
-                                / INVERTER_POLL_INTERVAL_SECONDS
-                            )
-                            + 1,
-                        ),
-                        1,
-                    )
-                )
-
-                inverter_grid_tied_load = (
-                    registers_to_signed_32(grid_power_data.registers, 10) / 10000
-                )
-                skyline_grid_tied_load = (
-                    skyline_grid_tied_load + inverter_grid_tied_load
-                )
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_tied_load"
-                ].set_native_value(inverter_grid_tied_load)
-
-                inverter_eps_load = (
-                    registers_to_signed_32(eps_data.registers, 3)
-                    + registers_to_signed_32(eps_data.registers, 9)
-                    + registers_to_signed_32(eps_data.registers, 14)
-                ) / 10000
-
-                skyline_eps_load = skyline_eps_load + inverter_eps_load
-                self.sensor_entities[
-                    inverter.serial_number + "_eps_load"
-                ].set_native_value(inverter_eps_load)
-
-                inverter_load = (
-                    registers_to_signed_32(inverter_power_data.registers, 2)
-                    + registers_to_signed_32(inverter_power_data.registers, 7)
-                    + registers_to_signed_32(inverter_power_data.registers, 12)
-                ) / 10000
-                skyline_inverter_load = skyline_inverter_load + inverter_load
-                self.sensor_entities[
-                    inverter.serial_number + "_inverter_load"
-                ].set_native_value(inverter_load)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_pv_energy_today"
-                ].set_native_value(
-                    inverter.shag_pv_energy_today(
-                        registers_to_unsigned_32(inverter_power_data.registers, 38)
-                        / 1000
-                    )
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_pv_energy_total"
-                ].set_native_value(
-                    registers_to_unsigned_32(inverter_power_data.registers, 32)
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_energy_in_total"
-                ].set_native_value(
-                    registers_to_unsigned_32(grid_power_data.registers, 6) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_energy_out_total"
-                ].set_native_value(
-                    registers_to_unsigned_32(grid_power_data.registers, 8) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_energy_in_today"
-                ].set_native_value(
-                    registers_to_unsigned_32(grid_power_data.registers, 50) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_energy_out_today"
-                ].set_native_value(
-                    registers_to_unsigned_32(grid_power_data.registers, 52) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_energy_in_total"
-                ].set_native_value(
-                    registers_to_unsigned_32(battery_data.registers, 13) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_energy_out_total"
-                ].set_native_value(
-                    registers_to_unsigned_32(battery_data.registers, 17) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_energy_in_today"
-                ].set_native_value(
-                    registers_to_unsigned_32(battery_data.registers, 11) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_energy_out_today"
-                ].set_native_value(
-                    registers_to_unsigned_32(battery_data.registers, 15) / 100
-                )
-
-                self.number_entities[
-                    inverter.serial_number + "_battery_max_soc"
-                ].set_number_value(inverter_config_data.registers[25])
-
-                self.number_entities[
-                    inverter.serial_number + "_grid_max_charge_soc"
-                ].set_number_value(inverter_config_data.registers[23])
-
-                self.number_entities[
-                    inverter.serial_number + "_grid_max_charge_power"
-                ].set_number_value(inverter_config_data.registers[22])
-
-                self.number_entities[
-                    inverter.serial_number + "_battery_max_charge_power"
-                ].set_number_value(inverter_config_data.registers[24])
-
-                self.number_entities[
-                    inverter.serial_number + "_battery_max_power"
-                ].set_number_value(inverter_config_data.registers[26])
-
-                self.number_entities[
-                    inverter.serial_number + "_grid_max_feed_in_power"
-                ].set_number_value(grid_config_data.registers[10])
-
-                work_mode = inverter_config_data.registers[0]
-
-                self.select_entities[
-                    inverter.serial_number + "_hybrid_work_mode"
-                ].set_selected_option(str(work_mode))
-
-                self.switch_entities[
-                    inverter.serial_number + "_eps_enabled"
-                ].set_selected_option(inverter_config_data.registers[28])
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_voltage"
-                ].set_native_value(battery_data.registers[6] / 10)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_battery_current"
-                ].set_native_value(
-                    registers_to_signed_32(battery_data.registers, 7) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_voltage"
-                ].set_native_value(grid_power_data.registers[26] / 10)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_grid_current"
-                ].set_native_value(
-                    registers_to_signed_32(grid_power_data.registers, 29) / 100
-                )
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt1_voltage"
-                ].set_native_value(inverter_power_data.registers[15] / 10)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt1_current"
-                ].set_native_value(inverter_power_data.registers[16] / 100)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt2_voltage"
-                ].set_native_value(inverter_power_data.registers[19] / 10)
-
-                self.sensor_entities[
-                    inverter.serial_number + "_mppt2_current"
-                ].set_native_value(inverter_power_data.registers[20] / 100)
-
-                self.binary_sensor_entities[
-                    inverter.serial_number + "_grid_am_exporting"
-                ].set_binary_value(self.am_exporting_importing(inverter, False))
+                await self.poll_all_inverters()
+            finally:
+                self._poll_depth = self._poll_depth - 1
+                if self._poll_depth == 0:
+                    self.flush_state_writes()
+
+    def schedule_state_write(self, entity) -> None:
+        """Write an entity's state at the end of the poll cycle, or now if not polling."""
+        if self._poll_depth == 0:
+            entity.async_write_ha_state()
+            self._last_state_write[id(entity)] = time.monotonic()
+            return
 
-                self.binary_sensor_entities[
-                    inverter.serial_number + "_grid_am_importing"
-                ].set_binary_value(self.am_exporting_importing(inverter, True))
+        self._dirty_entities[id(entity)] = entity
 
-                self.sensor_entities[
-                    inverter.serial_number + "_system_temp"
-                ].set_native_value(
-                    register_to_signed_16(inverter_power_data.registers[27])
-                )
+    def flush_state_writes(self) -> None:
+        """Write the states of entities changed during the poll cycle."""
+        now = time.monotonic()
+        for key, entity in list(self._dirty_entities.items()):
+            if (
+                self.min_publish_interval_seconds > 0
+                and now - self._last_state_write.get(key, 0)
+                < self.min_publish_interval_seconds
+            ):
+                continue  # left dirty so the latest value is written by a later cycle.
 
-                self.sensor_entities[
-                    inverter.serial_number + "_master_software_version"
-                ].set_native_value(inverter.master_software_version)
+            del self._dirty_entities[key]
+            self._last_state_write[key] = now
+            entity.async_write_ha_state()
 
-                self.sensor_entities[
-                    inverter.serial_number + "_slave_software_version"
-                ].set_native_value(inverter.slave_software_version)
+    async def poll_all_inverters(self):
+        """Poll all inverters for the register groups that are due."""
+        skyline_pv_power = float(0)
+        skyline_battery_load = float(0)
+        skyline_grid_load = float(0)
+        skyline_grid_tied_load = float(0)
+        skyline_eps_load = float(0)
+        skyline_inverter_load = float(0)
 
-                self.sensor_entities[
-                    inverter.serial_number + "_ems_software_version"
-                ].set_native_value(inverter.ems_software_version)
+        results = await self.poll_inverter_hosts()
 
-                self.sensor_entities[
-                    inverter.serial_number + "_dcdc_software_version"
-                ].set_native_value(inverter.dcdc_software_version)
+        for result in results:
+            if result is None:
+                return
 
-                self.switch_entities[
-                    inverter.serial_number + "_match_feed_in_to_excess_power"
-                ].set_selected_option(self.match_feed_in_to_excess_power)
+            skyline_pv_power = skyline_pv_power + result.get("pv_power", 0)
+            skyline_battery_load = skyline_battery_load + result.get("battery_load", 0)
+            skyline_grid_load = skyline_grid_load + result.get("grid_load", 0)
+            skyline_grid_tied_load = skyline_grid_tied_load + result.get(
+                "grid_tied_load", 0
+            )
+            skyline_eps_load = skyline_eps_load + result.get("eps_load", 0)
+            skyline_inverter_load = skyline_inverter_load + result.get(
+                "inverter_load", 0
+            )
 
-                self.number_entities[
-                    inverter.serial_number + "_excess_target_soc"
-                ].set_number_value(self.excess_target_soc)
-            
-                # No point in the below as the inverter is always returning zero until Skyline fix it.
-                # self.sensor_entities[
-                #    inverter.serial_number + "_battery_temp"
-                # ].set_native_value(register_to_signed_16(battery_data.registers[1]))
+            if "soc" in result:
+                self.current_state_of_charge = result["soc"]
 
-            except:  # noqa: E722
-                _LOGGER.info("Error retrieving inverter stats")
+            if "work_mode" in result:
+                self.work_mode = result["work_mode"]
 
         self.sensor_entities["skyline_consumer_load"].set_native_value(
             round(
                 self.aggregate(
                     "skyline_consumer_load",
                     skyline_eps_load + skyline_grid_tied_load,
-                    math.ceil(60 / INVERTER_POLL_INTERVAL_SECONDS),
+                    60,
                 ),
                 2,
             )
@@ -582,10 +449,7 @@ class Controller:
                 "skyline_average_excess_pv_power",
                 skyline_pv_power
                 - ((self_consumption_load + skyline_eps_load) * self.excess_load_ratio),
-                math.ceil(
-                    self.excess_averaging_period_seconds
-                    / INVERTER_POLL_INTERVAL_SECONDS
-                ),
+                self.excess_averaging_period_seconds,
                 always_aggregate=True,
             )
 
@@ -600,12 +464,12 @@ class Controller:
 
         _LOGGER.debug(
             "Work mode: %s, match_feed_in_to_excess: %s, last_update: %s",
-            work_mode,
+            self.work_mode,
             self.match_feed_in_to_excess_power,
             self.last_feed_in_poll,
         )
         if (
-            work_mode == 1
+            self.work_mode == 1
             and self.match_feed_in_to_excess_power is True
             and time.time() - self.last_feed_in_poll >= 60
         ):
@@ -619,7 +483,7 @@ class Controller:
                     self.aggregate(
                         "skyline_pv_power",
                         skyline_pv_power,
-                        math.ceil(60 / INVERTER_POLL_INTERVAL_SECONDS),
+                        60,
                     ),
                     2,
                 )
@@ -644,7 +508,263 @@ class Controller:
                 round(skyline_eps_load, 2)
             )
 
-        await self.record_stats_to_clickhouse()
+        self.record_stats()
+
+    async def poll_inverter_hosts(self):
+        """Poll inverters concurrently, one task per modbus host, returning results in inverter order."""
+        host_inverters = {}
+        for inverter in self.inverters:
+            if POLL_HOSTS_CONCURRENTLY is True:
+                host_inverters.setdefault(inverter.modbus_host, []).append(inverter)
+            else:
+                host_inverters.setdefault(None, []).append(inverter)
+
+        async def poll_host(inverters):
+            # Inverters sharing an adapter share its serial bus so are polled in turn.
+            hosts = {inverter.modbus_host for inverter in inverters}
+            for host in hosts:
+                host.begin_cycle()
+
+            results = {}
+            try:
+                for inverter in inverters:
+                    results[inverter] = await self.poll_inverter(inverter)
+            finally:
+                for host in hosts:
+                    host.end_cycle()
+
+            for inverter in inverters:
+                self.publish_modbus_state(inverter)
+            return results
+
+        results = {}
+        for host_results in await asyncio.gather(
+            *[poll_host(inverters) for inverters in host_inverters.values()]
+        ):
+            results.update(host_results)
+
+        return [results[inverter] for inverter in self.inverters]
+
+    def publish_modbus_state(self, inverter: Inverter):
+        """Publish the state of an inverter's modbus connection and its request stats."""
+        key = inverter.serial_number + "_modbus"
+        if key + "_connection" not in self.sensor_entities:
+            return
+
+        host = inverter.modbus_host
+        self.sensor_entities[key + "_connection"].set_native_value(
+            host.state,
+            {
+                "host": host.host,
+                "failures": host.failures,
+                "connects": host.connects,
+                "backoff_seconds": host.backoff_seconds,
+            },
+        )
+
+        if host.stats.mean_latency is not None:
+            self.sensor_entities[key + "_latency"].set_native_value(
+                round(host.stats.mean_latency, 3)
+            )
+        # The request counts climb every poll, so are left to the debug dump.
+        self.sensor_entities[key + "_errors"].set_native_value(host.stats.errors)
+
+        if "skyline_zero_guard_hits" in self.sensor_entities:
+            self.sensor_entities["skyline_zero_guard_hits"].set_native_value(
+                self.zero_guard_hits
+            )
+
+    def modbus_stats(self) -> dict:
+        """Gather modbus request and stats sink counts, for a debug dump."""
+        hosts = {}
+        for inverter in self.inverters:
+            host = inverter.modbus_host
+            hosts[host.host + ":" + str(host.port)] = {
+                "state": host.state,
+                "failures": host.failures,
+                "connects": host.connects,
+                "pipeline_depth": host.pipeline_depth,
+                **host.stats.as_dict(),
+            }
+
+        sinks = {}
+        for sink in self.stats.sinks:
+            sinks[sink.name] = {
+                "queued_rows": len(sink.rows),
+                "written_rows": sink.written_rows,
+                "dropped_rows": sink.dropped_rows,
+            }
+        if self.clickhouse_writer is not None:
+            sinks[self.clickhouse_writer.name]["replayed_rows"] = (
+                self.clickhouse_writer.replayed_rows
+            )
+
+        return {
+            "hosts": hosts,
+            "stats_sinks": sinks,
+            "zero_guard_hits": self.zero_guard_hits,
+            "poll_cycle": self.poll_durations.as_dict(),
+            "poll_overruns": self.poll_overruns,
+        }
+
+    def due_groups(self, inverter: Inverter, now: float) -> set:
+        """Get the register groups due a poll on an inverter."""
+        # Allow half a poll of jitter so a 30 second group isn't pushed out to 40 seconds.
+        tolerance = self.group_intervals[POWER] / 2
+        return {
+            group
+            for group, interval in self.group_intervals.items()
+            if group not in inverter.last_group_poll
+            or now - inverter.last_group_poll[group] >= interval - tolerance
+        }
+
+    async def poll_inverter(self, inverter: Inverter):
+        """Poll a single inverter, returning its contribution to the skyline totals or None if the cycle should be abandoned."""
+        result = {}
+
+        try:
+            now = time.monotonic()
+            groups = self.due_groups(inverter, now)
+
+            if VERSION in groups:
+                if await inverter.update_software_versions():
+                    # Discovery leaves versions to the first poll, so remember them now.
+                    self.topology_store.async_delay_save(
+                        self.topology, TOPOLOGY_SAVE_DELAY_SECONDS
+                    )
+                groups.discard(VERSION)
+
+            # Guard registers ride along in the blocks every poll reads anyway.
+            decoder = INVERTER_REGISTERS.decoder(groups, guards=True)
+            view = await inverter.read_register_plan(decoder.plan)
+            values = decoder.decode(view)
+
+            if values is None:
+                _LOGGER.error(
+                    "Skyline Inverter did not provide all results at host %s",
+                    inverter.modbus_host.host,
+                )
+                return None
+
+            # if grid and battery totals are zero, smell a mis-report
+            if (
+                values["grid_energy_in_total"] == 0
+                and values["grid_energy_out_total"] == 0
+                and values["battery_energy_in_total"] == 0
+                and values["battery_energy_out_total"] == 0
+            ):
+                self.zero_guard_hits = self.zero_guard_hits + 1
+                _LOGGER.error(
+                    "Skyline Inverter provided too many zero registers at host %s",
+                    inverter.modbus_host.host,
+                )
+                return None
+
+            for group in groups:
+                inverter.last_group_poll[group] = now
+
+            for key, total in decoder.totals:
+                result[total] = values[key]
+
+            if "soc" in values:
+                result["soc"] = values["soc"]
+
+            if "hybrid_work_mode" in values:
+                result["work_mode"] = values["hybrid_work_mode"]
+
+            if "pv_energy_today" in values:
+                values["pv_energy_today"] = inverter.shag_pv_energy_today(
+                    values["pv_energy_today"]
+                )
+
+            if "grid_load" in values:
+                values["grid_load"] = round(
+                    self.aggregate(
+                        inverter.serial_number + "_grid_load",
+                        values["grid_load"],
+                        30,
+                        retain_seconds=IMPORT_EXPORT_MONITOR_DURATION_SECONDS,
+                    ),
+                    1,
+                )
+
+                self.binary_sensor_entities[
+                    inverter.serial_number + "_grid_am_exporting"
+                ].set_binary_value(self.am_exporting_importing(inverter, False))
+
+                self.binary_sensor_entities[
+                    inverter.serial_number + "_grid_am_importing"
+                ].set_binary_value(self.am_exporting_importing(inverter, True))
+
+            self.publish_values(inverter, values)
+
+            self.sensor_entities[
+                inverter.serial_number + "_master_software_version"
+            ].set_native_value(inverter.master_software_version)
+
+            self.sensor_entities[
+                inverter.serial_number + "_slave_software_version"
+            ].set_native_value(inverter.slave_software_version)
+
+            self.sensor_entities[
+                inverter.serial_number + "_ems_software_version"
+            ].set_native_value(inverter.ems_software_version)
+
+            self.sensor_entities[
+                inverter.serial_number + "_dcdc_software_version"
+            ].set_native_value(inverter.dcdc_software_version)
+
+            self.switch_entities[
+                inverter.serial_number + "_match_feed_in_to_excess_power"
+            ].set_selected_option(self.match_feed_in_to_excess_power)
+
+            self.number_entities[
+                inverter.serial_number + "_excess_target_soc"
+            ].set_number_value(self.excess_target_soc)
+
+        except:  # noqa: E722
+            _LOGGER.info("Error retrieving inverter stats")
+
+        return result
+
+    def publish_values(self, inverter: Inverter, values: dict):
+        """Publish decoded register values to the inverter's entities."""
+        for key, setter, decimals in self.get_publishers(inverter):
+            if key not in values:
+                continue
+
+            if decimals is None:
+                setter(values[key])
+            else:
+                setter(round(values[key], decimals))
+
+    def get_publishers(self, inverter: Inverter):
+        """Get the entity setters for each register field of an inverter, resolved once."""
+        if inverter.serial_number in self._publishers:
+            return self._publishers[inverter.serial_number]
+
+        entities = {
+            SENSOR: (self.sensor_entities, "set_native_value"),
+            NUMBER: (self.number_entities, "set_number_value"),
+            SELECT: (self.select_entities, "set_selected_option"),
+            SWITCH: (self.switch_entities, "set_selected_option"),
+        }
+
+        publishers = []
+        for field in INVERTER_REGISTERS.fields:
+            entity_dict, method = entities[field.entity]
+            entity = entity_dict.get(inverter.serial_number + "_" + field.key)
+            if entity is None:
+                continue
+
+            setter = getattr(entity, method)
+            if field.entity == SELECT:
+                setter = lambda value, select=setter: select(str(value))  # noqa: E731
+
+            publishers.append((field.key, setter, field.decimals))
+
+        self._publishers[inverter.serial_number] = publishers
+        return publishers
 
     async def set_feed_in_excess(self, setting: bool):
         """Update the feed in excess setting."""
@@ -671,7 +791,7 @@ class Controller:
         to_value = self.aggregate(
             "skyline_average_excess_pv_power",
             0,
-            0,
+            self.excess_averaging_period_seconds,
             fetch_only=True,
             always_aggregate=True,
         )
@@ -760,155 +880,431 @@ class Controller:
 
         await self.set_register(self.inverters[0], 0x30BA, int(to_value), no_poll=True)
 
-    async def record_stats_to_clickhouse(self):
-        """Record all our sensors to a clickhouse database if configured."""
-        if self.clickhouse_url is None or len(self.clickhouse_url) < 5:
-            return
+    def create_stats_sinks(self):
+        """Create a sink for each configured stats destination."""
+        if self.clickhouse_url is not None and len(self.clickhouse_url) >= 5:
+            changes = None
+            if self.stats_mode == STATS_MODE_CHANGES:
+                changes = ChangeTracker(STATS_KEYFRAME_INTERVAL_SECONDS)
+
+            self.clickhouse_writer = ClickhouseWriter(
+                self.hass,
+                self.config,
+                self.clickhouse_url,
+                self.stats_schema,
+                changes=changes,
+                spool=StatsSpool(
+                    self.hass.config.path(DOMAIN + "_spool"),
+                    STATS_SPOOL_MAX_BYTES,
+                    STATS_SPOOL_SEGMENT_BYTES,
+                ),
+            )
+            self.stats.add(self.clickhouse_writer)
+
+        if self.local_stats:
+            self.stats.add(
+                SqliteStatsWriter(
+                    self.hass,
+                    self.config,
+                    self.hass.config.path(DOMAIN + "_stats.db"),
+                )
+            )
 
-        if self.clickhouse_is_init is True:
-            self.aio_http_session = async_get_clientsession(self.hass)
-            await self.clickhouse_exec(
-                "create table if not exists skyline_stats ( at_utc DateTime ) ENGINE = MergeTree PARTITION BY toYYYYMM(at_utc) ORDER BY at_utc;"
+        if self.influx_url is not None and len(self.influx_url) >= 5:
+            self.stats.add(
+                InfluxSink(self.hass, self.config, self.influx_url, self.influx_token)
             )
 
-        create = ""
+        if self.stats_file:
+            self.stats.add(
+                FileSink(
+                    self.hass, self.config, self.hass.config.path(DOMAIN + "_stats")
+                )
+            )
 
-        columns = ""
-        values = ""
+        if self.pushgateway_url is not None and len(self.pushgateway_url) >= 5:
+            self.stats.add(
+                PushgatewaySink(self.hass, self.config, self.pushgateway_url)
+            )
 
+    def record_stats(self):
+        """Queue all our sensors to be written to the configured stats sinks and metrics."""
+        row = {}
         for k in self.sensor_entities:
             e: SensorEntity = self.sensor_entities[k]
+            # Stats want every reading, not the state the deadband lets through.
+            value = e.latest_value
+            if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+                row[k.replace("-", "_")] = value
 
-            if self.clickhouse_is_init is True:
-                if create == "":
-                    create = (
-                        create
-                        + "alter table skyline_stats add column if not exists "
-                        + k.replace("-", "_")
-                        + " Float64"
-                    )
-                else:
-                    create = (
-                        create
-                        + ", add column if not exists "
-                        + k.replace("-", "_")
-                        + " Float64"
-                    )
+        if len(self.exposition.series) == 0:
+            self.define_metrics()
+        self.exposition.update(row)
+
+        if len(self.stats.sinks) == 0:
+            return
 
-            if columns == "":
-                columns = k.replace("-", "_")
-                values = str(e.native_value)
+        self.stats.record(row)
+        self.publish_stats_sinks()
+
+    def define_metrics(self):
+        """Define a metric series for each sensor, labelled by inverter."""
+        for column, (inverter, key) in self.stats_series().items():
+            e = self.sensor_entities[column]
+            if e.state_class is None and e.device_class is None:
+                metric_type = INFO
+            elif e.state_class == SensorStateClass.TOTAL_INCREASING:
+                metric_type = COUNTER
             else:
-                columns = columns + "," + k.replace("-", "_")
-                values = values + "," + str(e.native_value)
-
-        if self.clickhouse_is_init is True:
-            await self.clickhouse_exec(create + ";")
-            self.clickhouse_is_init = False
-
-        await self.clickhouse_exec(
-            "insert into skyline_stats ( at_utc,"  # noqa: S608
-            + columns
-            + ") values ( toDateTime(now(), 'UTC'),"
-            + values
-            + ");"
-        )
+                metric_type = GAUGE
 
-    async def clickhouse_exec(self, cmd: str):
-        """Execute a statement to the clikchouse database."""
-        try:
-            x = await self.aio_http_session.post(self.clickhouse_url, data=cmd)
+            self.exposition.define(
+                column.replace("-", "_"),
+                "skyline_" + key,
+                metric_type,
+                {"inverter": inverter},
+            )
 
-            if x.status != 200:
-                _LOGGER.error("Clickhouse command failed: %s", cmd)
-        except:  # noqa: E722
-            _LOGGER.error("Clickhouse command failed: %s", cmd)
+    def stats_series(self) -> dict:
+        """Map each sensor to the inverter serial, or skyline, and the key it's for."""
+        series = {}
+        for k, e in self.sensor_entities.items():
+            if getattr(e, "inverter", None) is not None:
+                serial = e.inverter.serial_number
+                series[k] = (serial, k[len(serial) + 1 :])
+            else:
+                series[k] = ("skyline", k.removeprefix("skyline_"))
+        return series
+
+    def publish_stats_sinks(self):
+        """Publish the state of each stats sink to the diagnostic sensors."""
+        for sink in self.stats.sinks:
+            key = "skyline_stats_" + sink.name
+            if key + "_latency" not in self.sensor_entities:
+                continue
+
+            if sink.latency.last is not None:
+                self.sensor_entities[key + "_latency"].set_native_value(
+                    round(sink.latency.last, 3), sink.latency.as_dict()
+                )
+            self.sensor_entities[key + "_queue"].set_native_value(len(sink.rows))
+            self.sensor_entities[key + "_dropped"].set_native_value(sink.dropped_rows)
+
+        if "skyline_stats_backlog" in self.sensor_entities:
+            writer = self.clickhouse_writer
+            spool = writer.spool
+            self.sensor_entities["skyline_stats_backlog"].set_native_value(
+                writer.backlog_rows,
+                {
+                    "spooled_bytes": 0 if spool is None else spool.size,
+                    "dropped_rows": writer.dropped_rows
+                    + (0 if spool is None else spool.dropped_rows),
+                },
+            )
+            self.sensor_entities["skyline_stats_replay_rate"].set_native_value(
+                round(writer.replay_rows_per_second)
+            )
+
+    def stats_schema(self):
+        """Get the clickhouse layout for the configured stats mode."""
+        if self.stats_mode == STATS_MODE_CHANGES:
+            return ChangesSchema(
+                {k.replace("-", "_"): v for k, v in self.stats_series().items()}
+            )
+
+        return StatsSchema(
+            {
+                k.replace("-", "_"): column_type(e)
+                for k, e in self.sensor_entities.items()
+            }
+        )
 
     async def set_register(
         self, inverter: Inverter, register: int, value: int, no_poll=False
     ):
-        """Set a modbus register from a change in HA."""
+        """Set a modbus register from a change in HA, batched with others made at the same time."""
+        if no_poll is True:
+            try:
+                await inverter.write_register(register, value)
+            except:  # noqa: E722
+                _LOGGER.info("Pymodbus still raising errors on register writes")
+            return
+
+        inverter.queue_write(register, value)
+        self._last_write_queued = time.monotonic()
+        if self._write_task is None:
+            self._write_task = self.config.async_create_background_task(
+                self.hass, self.flush_writes(), "Skyline Register Writes"
+            )
+
+    async def flush_writes(self):
+        """Write settings once they stop changing, then read back only the registers written."""
+        started = time.monotonic()
+        while True:
+            # Debounce, but don't let a setting that keeps changing hold writes back for long.
+            quiet = time.monotonic() - self._last_write_queued
+            if (
+                quiet >= MODBUS_WRITE_COALESCE_SECONDS
+                or time.monotonic() - started >= MODBUS_WRITE_DEBOUNCE_MAX_SECONDS
+            ):
+                break
+            await asyncio.sleep(MODBUS_WRITE_COALESCE_SECONDS - quiet)
+
+        # Never on the bus alongside a scheduled poll.
+        async with self._poll_lock:
+            self._write_task = None
+
+            written = {}
+            for inverter in self.inverters:
+                try:
+                    written[inverter] = await inverter.flush_writes()
+                except:  # noqa: E722
+                    _LOGGER.info("Pymodbus still raising errors on register writes")
+
+            self._poll_depth = self._poll_depth + 1
+            try:
+                for inverter, registers in written.items():
+                    if len(registers) > 0:
+                        await self.confirm_writes(inverter, registers)
+            finally:
+                self._poll_depth = self._poll_depth - 1
+                if self._poll_depth == 0:
+                    self.flush_state_writes()
+
+    async def confirm_writes(self, inverter: Inverter, registers: list):
+        """Read back the fields held in written registers and publish them."""
+        decoder = INVERTER_REGISTERS.decoder_for(registers)
+        if len(decoder.fields) == 0:
+            return
+
+        # The inverter may not have taken the value yet, so read it again next poll.
+        for group in {x.group for x in decoder.fields}:
+            inverter.last_group_poll.pop(group, None)
+
         try:
-            await inverter.write_register(register, value)
+            values = decoder.decode(await inverter.read_register_plan(decoder.plan))
         except:  # noqa: E722
-            _LOGGER.info("Pymodbus still raising errors on register writes")
-        if no_poll is False:
-            await self.poll_inverters()
+            values = None
+
+        if values is None:
+            _LOGGER.info("Unable to read back written registers, the next poll will")
+            return
+
+        if "hybrid_work_mode" in values:
+            self.work_mode = values["hybrid_work_mode"]
+
+        self.publish_values(inverter, values)
 
     async def update_ha_state(self):
         """Schedule an update for all other included entities."""
 
-    async def get_identity_info(self):
-        """Obtain the serial number, model etc."""
-        hosts = self.host.replace(" ", "").split(sep=",")
-        for host in hosts:
-            _LOGGER.info("Scanning for slaves on modbus host %s", host)
+    def modbus_hosts(self) -> list:
+        """The configured modbus hosts, sharing any connection already open to them."""
+        existing = {(x.modbus_host.host, x.modbus_host.port): x for x in self.inverters}
+        hosts = []
+        for host in self.host.replace(" ", "").split(sep=","):
             port = self.port
             if ":" in host:
                 port = int(host.split(sep=":")[1])
                 host = host.split(sep=":")[0]
 
-            modbus = ModbusHost(host=host, port=port)
-            detect_loops = 5  # We want to detect at least one slave on each specified modbus adapter, so retry if we don't
+            if (host, port) in existing:
+                hosts.append(existing[(host, port)].modbus_host)
+            else:
+                hosts.append(
+                    ModbusHost(
+                        host=host, port=port, pipeline_depth=self.modbus_pipeline_depth
+                    )
+                )
+        return hosts
+
+    async def get_identity_info(self):
+        """Obtain the serial number, model etc, scanning every modbus host at once."""
+        self.inverters.extend(await self.discover_inverters(self.modbus_hosts()))
+
+        if len(self.inverters) > 0:
+            self.have_identity_info = True
+
+    async def discover_inverters(self, hosts: list, lock=None) -> list:
+        """Scan modbus hosts concurrently, each against its own deadline, holding lock for each request if given.
+
+        Every host's inverters are needed before entities can be made, so this returns
+        once all hosts are scanned, at worst after the deadline for an adapter that's away.
+        """
+
+        async def scan(modbus: ModbusHost):
+            try:
+                return await asyncio.wait_for(
+                    self.scan_modbus_host(modbus, lock),
+                    MODBUS_DISCOVERY_DEADLINE_SECONDS,
+                )
+            except asyncio.TimeoutError:
+                _LOGGER.error(
+                    "Gave up scanning modbus host %s after %ss",
+                    modbus.host,
+                    MODBUS_DISCOVERY_DEADLINE_SECONDS,
+                )
+                # A request may have been cut off mid way, so drop the connection.
+                modbus.request_failed()
+                return []
+
+        # Keep the configured host order so entities come out the same each start.
+        inverters = []
+        for host_inverters in await asyncio.gather(*[scan(x) for x in hosts]):
+            inverters.extend(host_inverters)
+        return inverters
+
+    async def load_topology(self) -> bool:
+        """Create inverters from the topology found last time, if the hosts are unchanged."""
+        topology = await self.topology_store.async_load()
+        if (
+            topology is None
+            or topology.get("host") != self.host
+            or topology.get("port") != self.port
+            or len(topology.get("inverters", [])) == 0
+        ):
+            return False
+
+        hosts = {(x.host, x.port): x for x in self.modbus_hosts()}
+        for cached in topology["inverters"]:
+            host = hosts.get((cached["host"], cached["port"]))
+            if host is None:
+                return False
+
+            inverter = Inverter(
+                serial_number=cached["serial_number"],
+                model_number=cached["model_number"],
+                slave_address=cached["slave_address"],
+                host=host,
+            )
+            inverter.master_software_version = cached["master_software_version"]
+            inverter.slave_software_version = cached["slave_software_version"]
+            inverter.ems_software_version = cached["ems_software_version"]
+            inverter.dcdc_software_version = cached["dcdc_software_version"]
+            self.inverters.append(inverter)
+
+        _LOGGER.info("Using %s cached inverters", len(self.inverters))
+        self.have_identity_info = True
+        return True
+
+    def topology(self) -> dict:
+        """What's remembered of the inverters between starts."""
+        return {
+            "host": self.host,
+            "port": self.port,
+            "inverters": [topology_entry(x) for x in self.inverters],
+        }
+
+    async def save_topology(self):
+        """Remember the inverters found so the next start needn't wait for discovery."""
+        await self.topology_store.async_save(self.topology())
+
+    async def revalidate_topology(self):
+        """Rediscover inverters behind the cached ones, reloading if new ones turn up."""
+        # Scanning shares the hosts' connections, so take turns with the poller per request.
+        found = await self.discover_inverters(self.modbus_hosts(), self._poll_lock)
+
+        # Finding fewer inverters proves nothing, a slave may have just missed a probe.
+        known = {topology_key(x) for x in self.inverters}
+        new = [x for x in found if topology_key(x) not in known]
+        if len(new) == 0:
+            await self.save_topology()
+            return
 
-            while detect_loops > 0:
-                detect_loops = detect_loops - 1
-                for slave in range(1, MODBUS_MAX_SLAVE_ADDRESS + 1):
-                    try:
-                        _LOGGER.info("Attempting to query slave %s", str(slave))
-                        modelResponse = await modbus.read_holding_registers(
+        _LOGGER.warning("Skyline inverters have changed, reloading")
+        replaced = {(x.modbus_host, x.slave_address) for x in new}
+        self.inverters = [
+            x for x in self.inverters if (x.modbus_host, x.slave_address) not in replaced
+        ] + new
+        await self.save_topology()
+        self.hass.config_entries.async_schedule_reload(self.config.entry_id)
+
+    async def scan_modbus_host(self, modbus: ModbusHost, lock=None) -> list:
+        """Find the inverters on a modbus host, leaving software versions to the first poll."""
+        _LOGGER.info("Scanning for slaves on modbus host %s", modbus.host)
+        guard = contextlib.nullcontext() if lock is None else lock
+        inverters = []
+        detect_loops = 5  # We want to detect at least one slave on each specified modbus adapter, so retry if we don't
+
+        while detect_loops > 0:
+            detect_loops = detect_loops - 1
+            misses = 0
+            for slave in range(1, self.max_slave_address + 1):
+                try:
+                    _LOGGER.info("Attempting to query slave %s", str(slave))
+                    async with guard:
+                        modelResponse = await modbus.probe_holding_registers(
                             0x1A00, 8, slave_address=slave
                         )
 
-                        _LOGGER.info("Query complete, querying serial")
-
-                        if modelResponse.isError():
+                    if modelResponse is None or (
+                        modelResponse.isError()
+                        and getattr(modelResponse, "exception_code", None)
+                        in GATEWAY_EXCEPTION_CODES
+                    ):
+                        # Nobody at this address, slaves are rarely spread far apart.
+                        misses = misses + 1
+                        if misses >= MODBUS_SCAN_MAX_MISSES:
                             _LOGGER.info(
-                                "Stopped scanning for modbus slaves at slave %s",
-                                str(slave),
+                                "Stopped scanning for modbus slaves after %s missing from slave %s",
+                                misses,
+                                str(slave - misses + 1),
                             )
                             break
+                        continue
+                    misses = 0
+
+                    _LOGGER.info("Query complete, querying serial")
 
+                    if modelResponse.isError():
+                        _LOGGER.info(
+                            "Stopped scanning for modbus slaves at slave %s",
+                            str(slave),
+                        )
+                        break
+
+                    async with guard:
                         serialResponse = await modbus.read_holding_registers(
                             0x1A10, 8, slave_address=slave
                         )
 
-                        _LOGGER.info("Query complete")
-
-                        inverter = Inverter(
-                            serial_number=registers_to_string(
-                                serialResponse.registers, 0, 8
-                            ),
-                            model_number=registers_to_string(
-                                modelResponse.registers, 0, 8
-                            ),
-                            slave_address=slave,
-                            host=modbus,
-                        )
+                    _LOGGER.info("Query complete")
 
-                        _LOGGER.info("Created inverter")
+                    inverter = Inverter(
+                        serial_number=registers_to_string(
+                            serialResponse.registers, 0, 8
+                        ),
+                        model_number=registers_to_string(
+                            modelResponse.registers, 0, 8
+                        ),
+                        slave_address=slave,
+                        host=modbus,
+                    )
 
-                        _LOGGER.info(
-                            "Skyline Model Number is %s", inverter.model_number
-                        )
-                        _LOGGER.info(
-                            "Skyline Serial Number is %s", inverter.serial_number
-                        )
+                    _LOGGER.info("Created inverter")
 
-                        await inverter.update_software_versions()
+                    _LOGGER.info("Skyline Model Number is %s", inverter.model_number)
+                    _LOGGER.info(
+                        "Skyline Serial Number is %s", inverter.serial_number
+                    )
 
-                        detect_loops = 0
-                        self.inverters.append(inverter)
-                        self.have_identity_info = True
-                    except:  # noqa: E722
-                        _LOGGER.exception("Exception while scanning")
-                        _LOGGER.info(
-                            "Stopped scanning with exception for modbus host %s at slave %s",
-                            host,
-                            str(slave),
-                        )
-                        if detect_loops <= 0:
-                            break
+                    detect_loops = 0
+                    inverters.append(inverter)
+                except:  # noqa: E722
+                    _LOGGER.exception("Exception while scanning")
+                    _LOGGER.info(
+                        "Stopped scanning with exception for modbus host %s at slave %s",
+                        modbus.host,
+                        str(slave),
+                    )
+                    if detect_loops <= 0:
+                        break
+
+            if detect_loops > 0 and len(inverters) == 0:
+                # Let the adapter's reconnect backoff pass before trying again.
+                await asyncio.sleep(modbus.backoff_seconds)
+
+        return inverters
 
     def __del__(self):
         """Log deletion."""
@@ -917,14 +1313,35 @@ class Controller:
 
     def terminate(self):
         """End the controller."""
+        self.stop_tasks()
+        self.stats.terminate()
+
+    def stop_tasks(self):
+        """Stop polling and writing settings."""
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
         if self.poller_task is not None:
             self.poller_task.cancel()
             self.poller_task = None
             _LOGGER.info("Skyline is no longer polling")
 
+    async def async_terminate(self):
+        """End the controller, writing out buffered stats first."""
+        self.stop_tasks()
+        await self.stats.shutdown()
+
     async def initialise(self):
         """Self intialisation."""
+        self.create_stats_sinks()
+        if await self.load_topology():
+            # Checked once polling has started, so entity setup isn't held up by it.
+            self._revalidate_topology = True
+            return
+
         await self.get_identity_info()
+        if self.have_identity_info:
+            await self.save_topology()
 
     def get_sensor_entities(self):
         """Get sensor entities."""
@@ -958,43 +1375,33 @@ class Controller:
         if self._init_count >= len(PLATFORMS):
             await self.poll_inverters()
             await self.start_poller()
+            if self._revalidate_topology:
+                self._revalidate_topology = False
+                self.config.async_create_background_task(
+                    self.hass, self.revalidate_topology(), "Skyline Topology Check"
+                )
 
 
-def registers_to_string(registers, start: int, length: int):
-    """Convert a section of registers into a string."""
-    data = ""
-    i = 0
-    while i < length:
-        x = registers[start + i]
-        c = (x >> 8) & 0xFF
-        f = x & 0xFF
-
-        if c > 0:
-            data = data + chr(c)
-
-        if f > 0:
-            data = data + chr(f)
-
-        i = i + 1
-
-    return data.strip()
-
-
-def registers_to_signed_32(registers, pos):
-    """Convert a section of registers into a signed 32."""
-    regs = [registers[pos], registers[pos + 1]]
-    b = struct.pack(">2H", *regs)
-    return struct.unpack(">l", b)[0]
-
-
-def register_to_signed_16(register):
-    """Convert a section of registers into a signed 16."""
-    b = struct.pack(">H", register)
-    return struct.unpack(">h", b)[0]
-
-
-def registers_to_unsigned_32(registers, pos):
-    """Convert a section of registers into a unsigned 32."""
-    regs = [registers[pos], registers[pos + 1]]
-    b = struct.pack(">2H", *regs)
-    return struct.unpack(">L", b)[0]
+def topology_entry(inverter: Inverter) -> dict:
+    """What's remembered of an inverter between starts."""
+    return {
+        "host": inverter.modbus_host.host,
+        "port": inverter.modbus_host.port,
+        "slave_address": inverter.slave_address,
+        "serial_number": inverter.serial_number,
+        "model_number": inverter.model_number,
+        "master_software_version": inverter.master_software_version,
+        "slave_software_version": inverter.slave_software_version,
+        "ems_software_version": inverter.ems_software_version,
+        "dcdc_software_version": inverter.dcdc_software_version,
+    }
+
+
+def topology_key(inverter: Inverter) -> tuple:
+    """The identity of an inverter, ignoring what's expected to change like versions."""
+    return (
+        inverter.modbus_host.host,
+        inverter.modbus_host.port,
+        inverter.slave_address,
+        inverter.serial_number,
+    )
@@ -1,5 +1,6 @@
 """Skyline inverter modules."""
 
+import asyncio
 from datetime import datetime, timedelta
 import logging
 import time
@@ -9,51 +10,199 @@ from pymodbus.client import AsyncModbusTcpClient
 
 from homeassistant.helpers.device_registry import DeviceInfo
 
-from .const import DOMAIN, INVERTER_POLL_INTERVAL_SECONDS
+from .const import (
+    DOMAIN,
+    INVERTER_POLL_INTERVAL_SECONDS,
+    MODBUS_CONNECT_TIMEOUT_SECONDS,
+    MODBUS_MAX_WRITE_REGISTERS,
+    MODBUS_PROBE_TIMEOUT_SECONDS,
+    MODBUS_RECONNECT_MAX_SECONDS,
+    MODBUS_RECONNECT_MIN_SECONDS,
+    MODBUS_REQUEST_TIMEOUT_SECONDS,
+)
+from .metrics import ModbusStats
+from .pipeline import PipelinedModbusClient
+from .registers import INVERTER_REGISTERS, VERSION, RegisterView
 
 _LOGGER = logging.getLogger(__name__)
 
 
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+BACKOFF = "backoff"
+
+
 class ModbusHost:
-    """Defines a Modbus endpoint."""
+    """Defines a Modbus endpoint and manages the connection to it.
+
+    Every request has its own timeout. Within a poll cycle the first request that
+    times out or fails closes the connection and the rest of the cycle's requests
+    return None straight away, rather than each waiting out the timeout on a
+    half-open socket. Reconnects back off exponentially while the adapter is away.
+    """
 
-    def __init__(self, host: str, port: int) -> None:
+    def __init__(self, host: str, port: int, pipeline_depth: int = 1) -> None:
         """Modbus intitialiser."""
         self.host = host
         self.port = port
-        self.client = AsyncModbusTcpClient(
-            host=self.host, port=self.port, framer=FramerType.SOCKET
-        )
+        if pipeline_depth > 1:
+            self.client = PipelinedModbusClient(
+                host=self.host, port=self.port, depth=pipeline_depth
+            )
+        else:
+            self.client = AsyncModbusTcpClient(
+                host=self.host,
+                port=self.port,
+                framer=FramerType.SOCKET,
+                timeout=MODBUS_REQUEST_TIMEOUT_SECONDS,
+                retries=0,
+            )
+        self.state = DISCONNECTED
+        self.backoff_seconds = 0
+        self.next_connect_attempt = 0.0
+        self.in_cycle = False
+        self.cycle_failed = False
+        self.failures = 0
+        self.connects = 0
+        self.stats = ModbusStats()
+
+    @property
+    def pipeline_depth(self) -> int:
+        """The number of requests that may be in flight at once."""
+        return getattr(self.client, "depth", 1)
+
+    def begin_cycle(self) -> None:
+        """Start a poll cycle, giving a broken connection another go."""
+        self.in_cycle = True
+        self.cycle_failed = False
+
+    def end_cycle(self) -> None:
+        """Finish a poll cycle."""
+        self.in_cycle = False
+
+    async def connect(self) -> bool:
+        """Make sure we're connected, unless we're backing off after a failed attempt."""
+        if self.client.connected:
+            return True
+
+        if time.monotonic() < self.next_connect_attempt:
+            return False
 
-    async def read_holding_registers(self, start_address, num_registers, slave_address):
-        """Read registers from an inverter."""
-        if not self.client.connected:
-            await self.client.connect()
+        try:
+            await asyncio.wait_for(
+                self.client.connect(), MODBUS_CONNECT_TIMEOUT_SECONDS
+            )
+        except asyncio.CancelledError:
+            raise
+        except:  # noqa: E722
+            pass
 
         if not self.client.connected:
+            self.client.close()
+            self.backoff_seconds = min(
+                max(self.backoff_seconds * 2, MODBUS_RECONNECT_MIN_SECONDS),
+                MODBUS_RECONNECT_MAX_SECONDS,
+            )
+            self.next_connect_attempt = time.monotonic() + self.backoff_seconds
+            self.state = BACKOFF
+            _LOGGER.warning(
+                "Unable to connect to modbus host %s, retrying in %ss",
+                self.host,
+                self.backoff_seconds,
+            )
+            return False
+
+        if self.connects > 0:
+            _LOGGER.info("Reconnected to modbus host %s", self.host)
+        self.connects = self.connects + 1
+        self.backoff_seconds = 0
+        self.state = CONNECTED
+        return True
+
+    def request_failed(self) -> None:
+        """Drop a connection that didn't answer, and abandon the rest of the cycle."""
+        self.cycle_failed = self.in_cycle
+        if self.state != CONNECTED:
+            return  # other requests in flight on the same connection already failed.
+
+        self.failures = self.failures + 1
+        self.client.close()
+        self.state = DISCONNECTED
+        _LOGGER.warning("Lost connection to modbus host %s", self.host)
+
+    async def request(self, call, block=None):
+        """Make a request with a timeout, returning None if it couldn't be made."""
+        if self.cycle_failed and self.in_cycle:
             return None
 
+        if not await self.connect():
+            self.cycle_failed = self.in_cycle
+            return None
+
+        started = time.monotonic()
         try:
-            return await self.client.read_holding_registers(
-                address=start_address, count=num_registers, device_id=slave_address
-            )
+            response = await asyncio.wait_for(call(), MODBUS_REQUEST_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.stats.timed_out()
+            self.request_failed()
+            return None
         except:  # noqa: E722
+            self.stats.failed()
+            self.request_failed()
             return None
 
-    async def write_register(self, register, value, slave_address):
-        """Write data back to the inverter."""
-        if not self.client.connected:
-            await self.client.connect()
-        if not self.client.connected:
+        self.stats.answered(block, time.monotonic() - started, response)
+        return response
+
+    async def probe_holding_registers(
+        self, start_address, num_registers, slave_address
+    ):
+        """Read registers from a slave that may not exist, giving up on it quickly."""
+        if not await self.connect():
             return None
 
         try:
-            return await self.client.write_register(
-                address=register, value=value, device_id=slave_address
+            return await asyncio.wait_for(
+                self.client.read_holding_registers(
+                    address=start_address, count=num_registers, device_id=slave_address
+                ),
+                MODBUS_PROBE_TIMEOUT_SECONDS,
             )
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            return None  # nobody at this address, which isn't the connection's fault.
         except:  # noqa: E722
+            self.request_failed()
             return None
 
+    async def read_holding_registers(self, start_address, num_registers, slave_address):
+        """Read registers from an inverter."""
+        return await self.request(
+            lambda: self.client.read_holding_registers(
+                address=start_address, count=num_registers, device_id=slave_address
+            ),
+            block=f"{slave_address}:{start_address:#06x}+{num_registers}",
+        )
+
+    async def write_register(self, register, value, slave_address):
+        """Write data back to the inverter."""
+        return await self.request(
+            lambda: self.client.write_register(
+                address=register, value=value, device_id=slave_address
+            )
+        )
+
+    async def write_registers(self, register, values, slave_address):
+        """Write a run of registers back to the inverter in one request."""
+        return await self.request(
+            lambda: self.client.write_registers(
+                address=register, values=values, device_id=slave_address
+            )
+        )
+
 
 class Inverter:
     """An individual inverter."""
@@ -71,13 +220,14 @@ class Inverter:
         self.model_number = model_number
         self._host = host
         self._written_registers = {}
+        self._pending_writes = {}
         self.previous_pv_energy_today = float(0)
         self.pv_energy_today_offset = float(0)
         self.master_software_version = ""
         self.slave_software_version = ""
         self.ems_software_version = ""
         self.dcdc_software_version = ""
-        self.last_version_poll = None
+        self.last_group_poll = {}
 
         self.device_info = DeviceInfo(
             identifiers={(DOMAIN, self.serial_number)},
@@ -86,6 +236,16 @@ class Inverter:
             model=self.model_number,
         )
 
+    @property
+    def slave_address(self) -> int:
+        """The modbus slave address of the inverter."""
+        return self._slave_address
+
+    @property
+    def modbus_host(self) -> ModbusHost:
+        """The modbus adapter this inverter is reached through."""
+        return self._host
+
     def shag_pv_energy_today(self, pv_energy_today: float):
         """Shag a PV energy today from offset because CYG are useless."""
         if self.previous_pv_energy_today > pv_energy_today and pv_energy_today < 1:
@@ -95,53 +255,37 @@ class Inverter:
         self.previous_pv_energy_today = pv_energy_today
         return pv_energy_today - self.pv_energy_today_offset
 
-    def registers_to_string(self, registers, start: int, length: int):
-        """Convert a section of registers into a string."""
-        data = ""
-        i = 0
-        while i < length:
-            x = registers[start + i]
-            c = (x >> 8) & 0xFF
-            f = x & 0xFF
-
-            if c > 0:
-                data = data + chr(c)
+    async def update_software_versions(self) -> bool:
+        """Update software version numbers, returning whether any changed."""
+        self.last_group_poll[VERSION] = time.monotonic()
 
-            if f > 0:
-                data = data + chr(f)
+        decoder = INVERTER_REGISTERS.decoder({VERSION})
+        view = await self.read_register_plan(decoder.plan)
 
-            i = i + 1
+        # Decode each version alone so one unreadable block doesn't lose the others.
+        values = {}
+        for field in decoder.fields:
+            value = INVERTER_REGISTERS.decoder_for(field.addresses).decode(view)
+            if value is not None:
+                values.update(value)
 
-        return data.strip()
-
-    async def update_software_versions(self):
-        """Update software version numbers."""
-
-        if (
-            self.last_version_poll is None
-            or time.time() - self.last_version_poll > 7200
-        ):
-            self.last_version_poll = time.time()
-        else:
-            return
+        if len(values) == 0:
+            _LOGGER.info("Unable to get software versions")
+            return False
 
-        response = await self.read_holding_registers(0x1A1C, 3)
-        self.master_software_version = self.registers_to_string(
-            response.registers, 0, 3
+        previous = self.software_versions()
+        self.master_software_version = values.get(
+            "master_software_version", self.master_software_version
+        )
+        self.slave_software_version = values.get(
+            "slave_software_version", self.slave_software_version
+        )
+        self.ems_software_version = values.get(
+            "ems_software_version", self.ems_software_version
+        )
+        self.dcdc_software_version = values.get(
+            "dcdc_software_version", self.dcdc_software_version
         )
-
-        try:
-            response = await self.read_holding_registers(0x1A26, 3)
-            self.slave_software_version = self.registers_to_string(response.registers, 0, 3)
-
-            response = await self.read_holding_registers(0x1A60, 3)
-            self.ems_software_version = self.registers_to_string(response.registers, 0, 3)
-
-            response = await self.read_holding_registers(0x1A6F, 3)
-            self.dcdc_software_version = self.registers_to_string(response.registers, 0, 3)
-
-        except:  # noqa: E722
-            _LOGGER.info("Unable to get software versions")
 
         _LOGGER.info(
             "Inverter %s versions are Master: %s, Slave: %s, EMS: %s, DCDC: %s",
@@ -151,21 +295,76 @@ class Inverter:
             self.ems_software_version,
             self.dcdc_software_version,
         )
+        return self.software_versions() != previous
 
-    async def write_register(self, register, value):
-        """Write a register via modbus."""
-        _LOGGER.info("Setting register %s to %s", register, value)
+    def software_versions(self) -> tuple:
+        """The master, slave, EMS and DCDC software versions."""
+        return (
+            self.master_software_version,
+            self.slave_software_version,
+            self.ems_software_version,
+            self.dcdc_software_version,
+        )
+
+    def remember_write(self, register, value):
+        """Remember a written value so polls can check it was taken, and retry if not."""
         self._written_registers[register] = {
             "value": value,
             "attempts_left": 10,
             "from": datetime.now()
             + timedelta(seconds=INVERTER_POLL_INTERVAL_SECONDS - 1),
         }
+
+    async def write_register(self, register, value):
+        """Write a register via modbus."""
+        _LOGGER.info("Setting register %s to %s", register, value)
+        self.remember_write(register, value)
         response = await self._host.write_register(
             register=register, value=value, slave_address=self._slave_address
         )
         return response
 
+    def queue_write(self, register, value):
+        """Queue a register write to be sent with any others by flush_writes."""
+        _LOGGER.info("Queueing register %s set to %s", register, value)
+        self._pending_writes[register] = value
+
+    async def flush_writes(self) -> list:
+        """Send queued writes, each run of contiguous registers as one request, returning the registers written."""
+        pending = self._pending_writes
+        self._pending_writes = {}
+
+        runs = []
+        for register in sorted(pending):
+            if (
+                len(runs) > 0
+                and runs[-1][0] + len(runs[-1][1]) == register
+                and len(runs[-1][1]) < MODBUS_MAX_WRITE_REGISTERS
+            ):
+                runs[-1][1].append(pending[register])
+            else:
+                runs.append((register, [pending[register]]))
+
+        for start, values in runs:
+            if len(values) == 1:
+                await self.write_register(start, values[0])
+                continue
+
+            _LOGGER.info("Setting registers %s to %s", start, values)
+            for offset, value in enumerate(values):
+                self.remember_write(start + offset, value)
+            response = await self._host.write_registers(
+                register=start, values=values, slave_address=self._slave_address
+            )
+            if response is not None and response.isError():
+                # Not every device takes function 16, so fall back to one at a time.
+                # Without a response the connection's gone, and polls will retry them.
+                _LOGGER.info("Write of registers from %s failed, writing singly", start)
+                for offset, value in enumerate(values):
+                    await self.write_register(start + offset, value)
+
+        return sorted(pending)
+
     async def read_holding_registers(self, start_address, num_registers):
         """Read an array of registers through modbus."""
         try:
@@ -221,3 +420,44 @@ class Inverter:
             return registers
         except:  # noqa: E722
             return None
+
+    async def read_register_plan(self, plan) -> RegisterView:
+        """Read each block of a read plan, returning an address-indexed view of the results."""
+        view = RegisterView()
+        if self._host.pipeline_depth > 1:
+            # The gateway queues requests, so send every block without waiting.
+            responses = await asyncio.gather(
+                *[self.read_holding_registers(x.start, x.count) for x in plan]
+            )
+        else:
+            responses = None
+
+        for index, block in enumerate(plan):
+            if responses is not None:
+                response = responses[index]
+            else:
+                response = await self.read_holding_registers(block.start, block.count)
+            if response is not None and len(response.registers) >= block.count:
+                view.add(block.start, response.registers)
+                continue
+
+            if len(block.ranges) == 1:
+                continue
+
+            # Some registers in a merged gap may not be readable, so fall back to the original ranges.
+            _LOGGER.debug("Merged read of %s failed, reading ranges separately", block)
+            registers = [0] * block.count
+            complete = True
+            for start, count in block.ranges:
+                response = await self.read_holding_registers(start, count)
+                if response is not None and len(response.registers) >= count:
+                    offset = start - block.start
+                    registers[offset : offset + count] = response.registers[:count]
+                    view.add(start, response.registers)
+                else:
+                    complete = False
+
+            if complete:
+                view.add(block.start, registers)
+
+        return view
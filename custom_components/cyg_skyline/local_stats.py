@@ -0,0 +1,175 @@
+"""Local SQLite store of Skyline stats, for when there's no clickhouse to hand."""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import sqlite3
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import (
+    LOCAL_STATS_RAW_RETENTION_DAYS,
+    LOCAL_STATS_ROLLUP_RETENTION_DAYS,
+    LOCAL_STATS_ROLLUP_SECONDS,
+)
+from .stats import StatsSink
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SqliteStatsWriter(StatsSink):
+    """Buffers stats rows and writes them to SQLite in batched transactions.
+
+    Raw values go into a table per day, so old days are dropped rather than deleted
+    row by row, and every batch is also folded into rollups of count, sum, min, max
+    and last value per key for each of the rollup periods. Long range queries can
+    then read the rollups instead of scanning every poll. The database is only ever
+    touched from the executor, one batch at a time.
+    """
+
+    name = "sqlite"
+    title = "SQLite"
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, path: str) -> None:
+        """SQLite stats writer initialiser."""
+        super().__init__(hass, entry)
+        self.path = path
+        self.connection = None
+        self.key_ids = {}
+        self.raw_tables = set()
+        self.last_retention_day = None
+
+    async def write(self, batch) -> bool:
+        """Write a batch of rows from the executor."""
+        try:
+            await self.hass.async_add_executor_job(self.write_rows, batch)
+        except sqlite3.Error:
+            _LOGGER.exception("Unable to write stats to %s", self.path)
+            return False
+        return True
+
+    def open(self) -> None:
+        """Open the database and create the shared tables."""
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("pragma journal_mode=WAL")
+        self.connection.execute("pragma synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "create table if not exists stats_keys ( id integer primary key, name text unique not null )"
+            )
+            for period in LOCAL_STATS_ROLLUP_SECONDS:
+                self.connection.execute(
+                    f"create table if not exists rollup_{period} ( key_id integer not null, bucket integer not null, count integer not null, sum real not null, min real not null, max real not null, last real not null, primary key ( key_id, bucket ) ) without rowid"
+                )
+
+        self.key_ids = dict(
+            (name, key_id)
+            for key_id, name in self.connection.execute(
+                "select id, name from stats_keys"
+            )
+        )
+        self.raw_tables = {
+            name
+            for (name,) in self.connection.execute(
+                "select name from sqlite_master where type = 'table' and name like 'raw_%'"
+            )
+        }
+
+    def write_rows(self, batch) -> None:
+        """Write a batch of rows and their rollups in a single transaction."""
+        if self.connection is None:
+            self.open()
+
+        try:
+            self.write_batch(batch)
+        except sqlite3.Error:
+            # Start afresh so key ids added in the failed transaction are forgotten.
+            self.connection.close()
+            self.connection = None
+            raise
+
+        self.apply_retention(batch[-1][0])
+
+    def write_batch(self, batch) -> None:
+        """Insert raw values and upsert rollups for a batch in one transaction."""
+        values = {}
+        rollups = {period: {} for period in LOCAL_STATS_ROLLUP_SECONDS}
+        with self.connection:
+            for at, row in batch:
+                table = raw_table(at)
+                if table not in self.raw_tables:
+                    self.connection.execute(
+                        f"create table if not exists {table} ( key_id integer not null, at integer not null, value real not null, primary key ( key_id, at ) ) without rowid"
+                    )
+                    self.raw_tables.add(table)
+
+                for key, value in row.items():
+                    if isinstance(value, str):
+                        continue
+                    key_id = self.key_id(key)
+                    values.setdefault(table, []).append((key_id, at, value))
+
+                    # Fold the batch into one upsert per bucket rather than one per value.
+                    for period, buckets in rollups.items():
+                        start = at - at % period
+                        bucket = buckets.get((key_id, start))
+                        if bucket is None:
+                            buckets[(key_id, start)] = [1, value, value, value, value]
+                        else:
+                            bucket[0] = bucket[0] + 1
+                            bucket[1] = bucket[1] + value
+                            bucket[2] = min(bucket[2], value)
+                            bucket[3] = max(bucket[3], value)
+                            bucket[4] = value
+
+            for table, rows in values.items():
+                self.connection.executemany(
+                    f"insert or replace into {table} ( key_id, at, value ) values ( ?, ?, ? )",  # noqa: S608
+                    rows,
+                )
+
+            for period, buckets in rollups.items():
+                self.connection.executemany(
+                    f"insert into rollup_{period} ( key_id, bucket, count, sum, min, max, last ) values ( ?, ?, ?, ?, ?, ?, ? )"  # noqa: S608
+                    " on conflict ( key_id, bucket ) do update set count = count + excluded.count, sum = sum + excluded.sum,"
+                    " min = min(min, excluded.min), max = max(max, excluded.max), last = excluded.last",
+                    [(*k, *v) for k, v in buckets.items()],
+                )
+
+    def key_id(self, name: str) -> int:
+        """Get the id of a key, adding it if it's new."""
+        if name not in self.key_ids:
+            cursor = self.connection.execute(
+                "insert into stats_keys ( name ) values ( ? )", (name,)
+            )
+            self.key_ids[name] = cursor.lastrowid
+        return self.key_ids[name]
+
+    def apply_retention(self, at: int) -> None:
+        """Drop raw days and trim the finest rollup once a day."""
+        day = at // 86400
+        if self.last_retention_day == day:
+            return
+        self.last_retention_day = day
+
+        oldest_raw = raw_table(at - LOCAL_STATS_RAW_RETENTION_DAYS * 86400)
+        with self.connection:
+            for table in sorted(self.raw_tables):
+                if table < oldest_raw:
+                    self.connection.execute(f"drop table if exists {table}")
+                    self.raw_tables.discard(table)
+
+            finest = min(LOCAL_STATS_ROLLUP_SECONDS)
+            self.connection.execute(
+                f"delete from rollup_{finest} where bucket < ?",  # noqa: S608
+                (at - LOCAL_STATS_ROLLUP_RETENTION_DAYS * 86400,),
+            )
+
+
+def raw_table(at: int) -> str:
+    """The name of the raw table for the UTC day of a timestamp."""
+    return "raw_" + datetime.datetime.fromtimestamp(
+        at, datetime.timezone.utc
+    ).strftime("%Y%m%d")
@@ -0,0 +1,222 @@
+"""Lightweight runtime metrics for Skyline diagnostics."""
+
+from bisect import bisect_left
+
+DURATION_BUCKETS_SECONDS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+
+
+class Histogram:
+    """Counts of observations falling into fixed upper-bounded buckets."""
+
+    def __init__(self, buckets=None) -> None:
+        """Histogram initialiser."""
+        self.buckets = list(DURATION_BUCKETS_SECONDS if buckets is None else buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = float(0)
+        self.maximum = float(0)
+        self.last = None
+
+    def observe(self, value: float) -> None:
+        """Record an observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        self.maximum = max(self.maximum, value)
+        self.last = value
+
+    @property
+    def mean(self) -> float | None:
+        """The mean of all observations."""
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def as_dict(self) -> dict:
+        """Summarise for entity attributes and debug dumps."""
+        # cumulative, as with prometheus histograms.
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative = cumulative + count
+            buckets["le_" + str(bound)] = cumulative
+        buckets["le_inf"] = self.count
+
+        return {
+            "count": self.count,
+            "mean": None if self.mean is None else round(self.mean, 4),
+            "max": round(self.maximum, 4),
+            "buckets": buckets,
+        }
+
+
+# Exception codes a TCP to RTU gateway answers with when the serial side fails. CRC
+# errors on the serial bus aren't visible over TCP, they show up as these instead.
+GATEWAY_EXCEPTION_CODES = (0x0A, 0x0B)
+
+
+class ModbusStats:
+    """Latency of each register block read and counts of the ways requests fail."""
+
+    def __init__(self) -> None:
+        """Modbus stats initialiser."""
+        self.blocks = {}
+        self.requests = 0
+        self.timeouts = 0
+        self.exceptions = 0
+        self.modbus_errors = 0
+        self.gateway_errors = 0
+        self.total_seconds = float(0)
+
+    @property
+    def errors(self) -> int:
+        """All failed requests, whatever the reason."""
+        return self.timeouts + self.exceptions + self.modbus_errors
+
+    @property
+    def mean_latency(self) -> float | None:
+        """The mean seconds taken by an answered request."""
+        answered = self.requests - self.timeouts - self.exceptions
+        if answered <= 0:
+            return None
+        return self.total_seconds / answered
+
+    def answered(self, block: str | None, seconds: float, response) -> None:
+        """Record a request the device or gateway answered."""
+        self.requests = self.requests + 1
+        self.total_seconds = self.total_seconds + seconds
+        if block is not None:
+            self.blocks.setdefault(block, Histogram()).observe(seconds)
+
+        if response is not None and response.isError():
+            self.modbus_errors = self.modbus_errors + 1
+            if getattr(response, "exception_code", None) in GATEWAY_EXCEPTION_CODES:
+                self.gateway_errors = self.gateway_errors + 1
+
+    def timed_out(self) -> None:
+        """Record a request that wasn't answered in time."""
+        self.requests = self.requests + 1
+        self.timeouts = self.timeouts + 1
+
+    def failed(self) -> None:
+        """Record a request that failed in the transport."""
+        self.requests = self.requests + 1
+        self.exceptions = self.exceptions + 1
+
+    def counts(self) -> dict:
+        """The failure counts, for entity attributes."""
+        return {
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "exceptions": self.exceptions,
+            "modbus_errors": self.modbus_errors,
+            "gateway_errors": self.gateway_errors,
+        }
+
+    def as_dict(self) -> dict:
+        """Summarise for debug dumps."""
+        return {
+            **self.counts(),
+            "blocks": {k: v.as_dict() for k, v in sorted(self.blocks.items())},
+        }
+
+
+GAUGE = "gauge"
+COUNTER = "counter"
+INFO = "info"
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class MetricFamily:
+    """The rendered samples of one metric name."""
+
+    def __init__(self, name: str, metric_type: str) -> None:
+        """Metric family initialiser."""
+        self.name = name
+        self.metric_type = metric_type
+        self.samples = {}
+        self.text = None
+
+
+class OpenMetricsBuffer:
+    """An OpenMetrics exposition kept rendered between scrapes.
+
+    Series are defined once, then each update re-renders only the samples whose
+    value changed and the families they belong to. A scrape with nothing changed
+    returns the same bytes without touching any series.
+    """
+
+    def __init__(self) -> None:
+        """OpenMetrics buffer initialiser."""
+        self.families = {}
+        self.series = {}
+        self._body = None
+
+    def define(self, key: str, name: str, metric_type: str, labels: dict) -> None:
+        """Define the series a key's values are published to."""
+        if name not in self.families:
+            self.families[name] = MetricFamily(name, metric_type)
+        family = self.families[name]
+
+        sample = name + {COUNTER: "_total", INFO: "_info"}.get(family.metric_type, "")
+        self.series[key] = [family, sample, render_labels(labels), None]
+
+    def update(self, values: dict) -> None:
+        """Re-render the series whose values have changed."""
+        for key, value in values.items():
+            series = self.series.get(key)
+            if series is None or series[3] == value:
+                continue
+
+            family, sample, labels, _ = series
+            series[3] = value
+            if family.metric_type == INFO:
+                line = (
+                    sample
+                    + "{"
+                    + labels
+                    + ',value="'
+                    + escape_label(str(value))
+                    + '"} 1\n'
+                )
+            elif isinstance(value, str):
+                continue
+            else:
+                line = sample + "{" + labels + "} " + repr(float(value)) + "\n"
+
+            family.samples[key] = line
+            family.text = None
+            self._body = None
+
+    def render(self) -> bytes:
+        """Get the exposition, re-joining only the families that changed."""
+        if self._body is None:
+            parts = []
+            for family in self.families.values():
+                if len(family.samples) == 0:
+                    continue
+                if family.text is None:
+                    family.text = (
+                        "# TYPE "
+                        + family.name
+                        + " "
+                        + family.metric_type
+                        + "\n"
+                        + "".join(family.samples.values())
+                    )
+                parts.append(family.text)
+            parts.append("# EOF\n")
+            self._body = "".join(parts).encode("utf-8")
+
+        return self._body
+
+
+def render_labels(labels: dict) -> str:
+    """Render the labels of a sample, without the braces."""
+    return ",".join(k + '="' + escape_label(v) + '"' for k, v in labels.items())
+
+
+def escape_label(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -266,4 +266,4 @@ class InverterNumberEntity(NumberEntity):
         self.currentValue = newValue
 
         self._attr_native_value = self.currentValue
-        self.async_write_ha_state()
+        self.controller.schedule_state_write(self)
@@ -0,0 +1,210 @@
+"""Modbus TCP client keeping several requests in flight on one connection."""
+
+import asyncio
+import logging
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+MBAP_HEADER = struct.Struct(">HHHB")  # transaction id, protocol id, length, unit id
+REQUEST = struct.Struct(">BHH")  # function code, address, count or value
+
+READ_HOLDING_REGISTERS = 0x03
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+EXCEPTION_FLAG = 0x80
+
+
+class PipelinedResponse:
+    """A decoded response, answering the same questions as a pymodbus response."""
+
+    def __init__(self, function_code: int, pdu: bytes) -> None:
+        """Pipelined response initialiser."""
+        self.function_code = function_code
+        self.exception_code = 0
+        self.registers = []
+        self.address = None
+        self.value = None
+        self.count = None
+
+        if function_code & EXCEPTION_FLAG:
+            self.exception_code = pdu[1]
+        elif function_code == READ_HOLDING_REGISTERS:
+            count = pdu[1] // 2
+            self.registers = list(struct.unpack_from(">" + "H" * count, pdu, 2))
+        elif function_code == WRITE_SINGLE_REGISTER:
+            self.address, self.value = struct.unpack_from(">HH", pdu, 1)
+        elif function_code == WRITE_MULTIPLE_REGISTERS:
+            self.address, self.count = struct.unpack_from(">HH", pdu, 1)
+
+    def isError(self) -> bool:  # noqa: N802
+        """Determine if the gateway or device answered with an exception."""
+        return self.function_code & EXCEPTION_FLAG != 0
+
+
+class PipelinedModbusClient:
+    """A raw Modbus TCP client matching responses to requests by transaction id.
+
+    Up to depth requests are written without waiting for the ones before them to be
+    answered, so a gateway that queues transactions hides the network round trip
+    between them. Gateways that answer with transaction ids we aren't waiting on,
+    or drop the connection with several requests outstanding, are dropped back to
+    one request at a time for the life of the client.
+    """
+
+    def __init__(self, host: str, port: int, depth: int) -> None:
+        """Pipelined client initialiser."""
+        self.host = host
+        self.port = port
+        self.depth = max(depth, 1)
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.pending = {}
+        self.in_flight = 0
+        self.slot_free = asyncio.Condition()
+        self.transaction_id = 0
+        self.abandoned = set()
+
+    @property
+    def connected(self) -> bool:
+        """Determine if there's an open connection."""
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self) -> bool:
+        """Open the connection and start reading responses."""
+        if self.connected:
+            return True
+
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reader_task = asyncio.get_running_loop().create_task(
+            self.read_responses(self.reader)
+        )
+        return True
+
+    def close(self) -> None:
+        """Close the connection, failing anything still waiting on it."""
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        self.reader = None
+        self.abandoned.clear()
+        self.fail_pending(ConnectionError("Modbus connection closed"))
+
+    def fail_pending(self, error: Exception) -> None:
+        """Fail every request waiting on a response."""
+        pending = self.pending
+        self.pending = {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def fall_back(self, reason: str) -> None:
+        """Stop pipelining to a gateway that can't cope with it."""
+        if self.depth > 1:
+            _LOGGER.warning(
+                "Modbus gateway %s %s, no longer pipelining requests",
+                self.host,
+                reason,
+            )
+            self.depth = 1
+
+    async def read_responses(self, reader: asyncio.StreamReader) -> None:
+        """Read responses and hand each to the request with its transaction id."""
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit = MBAP_HEADER.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+
+                if transaction_id in self.abandoned:
+                    self.abandoned.discard(transaction_id)
+                    continue
+
+                request = self.pending.pop(transaction_id, None)
+                if request is None or protocol_id != 0:
+                    self.fall_back("answered a transaction we weren't waiting on")
+                    continue
+
+                future, (expected_unit, function_code) = request
+                if unit != expected_unit or pdu[0] & ~EXCEPTION_FLAG != function_code:
+                    self.fall_back("mixed up the answers to pipelined requests")
+                    if not future.done():
+                        future.set_exception(
+                            ConnectionError("Mismatched modbus response")
+                        )
+                    continue
+
+                if not future.done():
+                    future.set_result(PipelinedResponse(pdu[0], pdu))
+        except asyncio.CancelledError:
+            raise
+        except:  # noqa: E722
+            if len(self.pending) > 1:
+                self.fall_back("dropped the connection with several requests queued")
+            if self.writer is not None:
+                self.writer.close()
+            self.fail_pending(ConnectionError("Modbus connection lost"))
+
+    async def request(self, unit: int, function_code: int, pdu: bytes):
+        """Send a request once there's a free slot and wait for its response."""
+        async with self.slot_free:
+            await self.slot_free.wait_for(lambda: self.in_flight < self.depth)
+            self.in_flight = self.in_flight + 1
+
+        try:
+            if not self.connected:
+                raise ConnectionError("Modbus connection closed")
+
+            self.transaction_id = self.transaction_id % 0xFFFF + 1
+            transaction_id = self.transaction_id
+            future = asyncio.get_running_loop().create_future()
+            self.pending[transaction_id] = (future, (unit, function_code))
+
+            self.writer.write(
+                MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit) + pdu
+            )
+            try:
+                await self.writer.drain()
+                return await future
+            except asyncio.CancelledError:
+                # Timed out, a late answer may still arrive so expect it.
+                self.pending.pop(transaction_id, None)
+                self.abandoned.add(transaction_id)
+                if self.in_flight > 1:
+                    self.fall_back("stopped answering with several requests queued")
+                raise
+        finally:
+            async with self.slot_free:
+                self.in_flight = self.in_flight - 1
+                self.slot_free.notify()
+
+    async def read_holding_registers(self, address: int, count: int, device_id: int):
+        """Read holding registers."""
+        return await self.request(
+            device_id,
+            READ_HOLDING_REGISTERS,
+            REQUEST.pack(READ_HOLDING_REGISTERS, address, count),
+        )
+
+    async def write_register(self, address: int, value: int, device_id: int):
+        """Write a single holding register."""
+        return await self.request(
+            device_id,
+            WRITE_SINGLE_REGISTER,
+            REQUEST.pack(WRITE_SINGLE_REGISTER, address, value),
+        )
+
+    async def write_registers(self, address: int, values: list, device_id: int):
+        """Write a run of holding registers."""
+        return await self.request(
+            device_id,
+            WRITE_MULTIPLE_REGISTERS,
+            REQUEST.pack(WRITE_MULTIPLE_REGISTERS, address, len(values))
+            + struct.pack(">B" + "H" * len(values), len(values) * 2, *values),
+        )
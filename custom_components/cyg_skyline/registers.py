@@ -0,0 +1,376 @@
+"""Skyline modbus register map, read planning and decoding."""
+
+from __future__ import annotations
+
+import struct
+
+from .const import MODBUS_MAX_READ_REGISTERS, MODBUS_READ_GAP_TOLERANCE
+
+U16 = "u16"
+S16 = "s16"
+U32 = "u32"
+S32 = "s32"
+STRING = "string"
+
+SENSOR = "sensor"
+NUMBER = "number"
+SELECT = "select"
+SWITCH = "switch"
+
+POWER = "power"
+ENERGY = "energy"
+CONFIG = "config"
+VERSION = "version"
+
+
+class RegisterBlock:
+    """A contiguous run of registers fetched in a single modbus read."""
+
+    def __init__(self, start: int, count: int, ranges: list) -> None:
+        """Register block initialiser."""
+        self.start = start
+        self.count = count
+        self.ranges = ranges
+
+    def __repr__(self) -> str:
+        """Describe the block for logging."""
+        return f"RegisterBlock(0x{self.start:04X}, {self.count})"
+
+
+def plan_reads(
+    ranges,
+    max_gap: int = MODBUS_READ_GAP_TOLERANCE,
+    max_count: int = MODBUS_MAX_READ_REGISTERS,
+) -> list[RegisterBlock]:
+    """Merge (start, count) register ranges into as few reads as the PDU limit allows.
+
+    Ranges that overlap or are separated by no more than max_gap registers are read
+    together, the registers in the gap are simply discarded.
+    """
+    blocks = []
+    for start, count in sorted(set(ranges)):
+        if len(blocks) > 0:
+            block = blocks[-1]
+            end = max(block.start + block.count, start + count)
+            if (
+                start - (block.start + block.count) <= max_gap
+                and end - block.start <= max_count
+            ):
+                block.count = end - block.start
+                block.ranges.append((start, count))
+                continue
+
+        blocks.append(RegisterBlock(start, count, [(start, count)]))
+
+    return blocks
+
+
+class RegisterView:
+    """Address-indexed view over the registers returned by a read plan."""
+
+    def __init__(self) -> None:
+        """Register view initialiser."""
+        self._blocks = []
+
+    def add(self, start: int, registers) -> None:
+        """Add a run of registers read from the start address."""
+        self._blocks.append((start, list(registers)))
+
+    def _find(self, address: int, count: int = 1):
+        for start, registers in self._blocks:
+            if start <= address and address + count <= start + len(registers):
+                return start, registers
+        return None, None
+
+    def contains(self, address: int, count: int = 1) -> bool:
+        """Determine if all registers of a range were read."""
+        return self._find(address, count)[0] is not None
+
+    def registers(self, address: int, count: int) -> list | None:
+        """Get a range of registers, or None if they were not all read."""
+        start, registers = self._find(address, count)
+        if start is None:
+            return None
+        return registers[address - start : address - start + count]
+
+    def __getitem__(self, address: int) -> int:
+        """Get a single register by address."""
+        start, registers = self._find(address)
+        if start is None:
+            raise KeyError(address)
+        return registers[address - start]
+
+
+class RegisterField:
+    """A value decoded from inverter registers and the entity it is published to.
+
+    The address may be a tuple of addresses, in which case the values are summed
+    before scaling. Values are divided by scale, rounded to decimals when published
+    and added to the named skyline total if total is set. The group determines how
+    often the field is polled, though guard fields are read with every poll to check
+    the inverter isn't mis-reporting.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        address,
+        data_type=U16,
+        scale=1,
+        decimals=None,
+        entity=SENSOR,
+        total=None,
+        length=1,
+        group=POWER,
+        guard=False,
+    ) -> None:
+        """Register field initialiser."""
+        self.key = key
+        self.addresses = address if isinstance(address, tuple) else (address,)
+        self.data_type = data_type
+        self.words = length if data_type == STRING else WORD_COUNTS[data_type]
+        self.scale = scale
+        self.decimals = decimals
+        self.entity = entity
+        self.total = total
+        self.group = group
+        self.guard = guard
+
+
+class RegisterMap:
+    """A set of register fields, compiled into read plans and decode loops per set of groups."""
+
+    def __init__(self, fields: list[RegisterField]) -> None:
+        """Register map initialiser."""
+        self.fields = fields
+        self.groups = frozenset(x.group for x in fields)
+        self._decoders = {}
+        self._field_decoders = {}
+
+    def decoder(self, groups=None, guards=False) -> RegisterDecoder:
+        """Get the compiled decoder for the fields in the given groups, or all groups, and optionally the guard fields."""
+        groups = self.groups if groups is None else frozenset(groups) & self.groups
+        if (groups, guards) not in self._decoders:
+            self._decoders[(groups, guards)] = RegisterDecoder(
+                [x for x in self.fields if x.group in groups or (guards and x.guard)]
+            )
+        return self._decoders[(groups, guards)]
+
+    def decoder_for(self, addresses) -> RegisterDecoder:
+        """Get the compiled decoder for just the fields held in any of the given addresses."""
+        fields = [
+            x
+            for x in self.fields
+            if any(
+                start <= address < start + x.words
+                for start in x.addresses
+                for address in addresses
+            )
+        ]
+        key = frozenset(x.key for x in fields)
+        if key not in self._field_decoders:
+            self._field_decoders[key] = RegisterDecoder(fields)
+        return self._field_decoders[key]
+
+
+class RegisterDecoder:
+    """A read plan and decode loop compiled for a set of register fields."""
+
+    def __init__(self, fields: list[RegisterField]) -> None:
+        """Register decoder initialiser."""
+        self.fields = fields
+        self.totals = [(x.key, x.total) for x in fields if x.total is not None]
+
+        slots = sorted(
+            {
+                (address, x.data_type, x.words)
+                for x in fields
+                for address in x.addresses
+            }
+        )
+        self.plan = plan_reads([(address, words) for address, _, words in slots])
+
+        slot_index = {slot: i for i, slot in enumerate(slots)}
+        self._slot_count = len(slots)
+        self._strings = [slot_index[x] for x in slots if x[1] == STRING]
+        self._blocks = [compile_block(block, slots, slot_index) for block in self.plan]
+
+        self._fields = [
+            (
+                x.key,
+                tuple(
+                    slot_index[(address, x.data_type, x.words)]
+                    for address in x.addresses
+                ),
+                x.scale,
+            )
+            for x in fields
+        ]
+
+    def decode(self, view: RegisterView) -> dict | None:
+        """Decode every field from a view, or None if any block is missing."""
+        raw = [0] * self._slot_count
+        for block, words, passes in self._blocks:
+            registers = view.registers(block.start, block.count)
+            if registers is None:
+                return None
+
+            # Pack the block once, then pull all of its slots out in one unpack per pass.
+            buffer = words.pack(*registers)
+            for unpacker, indexes in passes:
+                if isinstance(indexes, slice):
+                    raw[indexes] = unpacker.unpack_from(buffer)
+                else:
+                    for index, value in zip(indexes, unpacker.unpack_from(buffer)):
+                        raw[index] = value
+
+        for index in self._strings:
+            raw[index] = raw[index].replace(b"\x00", b"").decode("latin-1").strip()
+
+        values = {}
+        for key, indexes, scale in self._fields:
+            if len(indexes) == 1:
+                value = raw[indexes[0]]
+            else:
+                value = 0
+                for index in indexes:
+                    value = value + raw[index]
+
+            if scale != 1:
+                value = value / scale
+
+            values[key] = value
+
+        return values
+
+
+def registers_to_string(registers, start: int, length: int):
+    """Convert a section of registers into a string."""
+    data = ""
+    i = 0
+    while i < length:
+        x = registers[start + i]
+        c = (x >> 8) & 0xFF
+        f = x & 0xFF
+
+        if c > 0:
+            data = data + chr(c)
+
+        if f > 0:
+            data = data + chr(f)
+
+        i = i + 1
+
+    return data.strip()
+
+
+def compile_block(block: RegisterBlock, slots, slot_index):
+    """Compile the struct formats that decode every slot within a block.
+
+    Slots are laid out in address order with pad bytes between them. Should two
+    slots overlap, the later one is placed in a further pass over the same buffer.
+    """
+    passes = []
+    for slot in slots:
+        address, data_type, words = slot
+        if not block.start <= address < block.start + block.count:
+            continue
+
+        offset = address - block.start
+        for layout in passes:
+            if layout[0] <= offset:
+                break
+        else:
+            layout = [0, ">", []]
+            passes.append(layout)
+
+        layout[1] = layout[1] + "x" * ((offset - layout[0]) * 2)
+        if data_type == STRING:
+            layout[1] = layout[1] + str(words * 2) + "s"
+        else:
+            layout[1] = layout[1] + STRUCT_CODES[data_type]
+        layout[0] = offset + words
+        layout[2].append(slot_index[slot])
+
+    compiled = []
+    for _, fmt, indexes in passes:
+        if indexes == list(range(indexes[0], indexes[-1] + 1)):
+            indexes = slice(indexes[0], indexes[-1] + 1)
+        compiled.append((struct.Struct(fmt), indexes))
+
+    return block, struct.Struct(">" + str(block.count) + "H"), compiled
+
+
+WORD_COUNTS = {U16: 1, S16: 1, U32: 2, S32: 2}
+
+STRUCT_CODES = {U16: "H", S16: "h", U32: "L", S32: "l"}
+
+INVERTER_REGISTERS = RegisterMap(
+    [
+        RegisterField("soc", 0x2000),
+        RegisterField(
+            "pv_power", (0x1012, 0x1016), U32, 10000, decimals=1, total="pv_power"
+        ),
+        RegisterField("mppt1_power", 0x1012, U32, 10000),
+        RegisterField("mppt2_power", 0x1016, U32, 10000),
+        RegisterField("battery_load", 0x2009, S32, 10000, total="battery_load"),
+        RegisterField("grid_load", 0x1300, S32, 10000, total="grid_load"),
+        RegisterField("grid_tied_load", 0x130A, S32, 10000, total="grid_tied_load"),
+        RegisterField(
+            "eps_load", (0x1353, 0x1359, 0x135E), S32, 10000, total="eps_load"
+        ),
+        RegisterField(
+            "inverter_load",
+            (0x1003, 0x1008, 0x100D),
+            S32,
+            10000,
+            total="inverter_load",
+        ),
+        RegisterField("pv_energy_today", 0x1027, U32, 1000, group=ENERGY),
+        RegisterField("pv_energy_total", 0x1021, U32, group=ENERGY),
+        RegisterField(
+            "grid_energy_in_total", 0x1306, U32, 100, group=ENERGY, guard=True
+        ),
+        RegisterField(
+            "grid_energy_out_total", 0x1308, U32, 100, group=ENERGY, guard=True
+        ),
+        RegisterField("grid_energy_in_today", 0x1332, U32, 100, group=ENERGY),
+        RegisterField("grid_energy_out_today", 0x1334, U32, 100, group=ENERGY),
+        RegisterField(
+            "battery_energy_in_total", 0x200D, U32, 100, group=ENERGY, guard=True
+        ),
+        RegisterField(
+            "battery_energy_out_total", 0x2011, U32, 100, group=ENERGY, guard=True
+        ),
+        RegisterField("battery_energy_in_today", 0x200B, U32, 100, group=ENERGY),
+        RegisterField("battery_energy_out_today", 0x200F, U32, 100, group=ENERGY),
+        RegisterField("battery_max_soc", 0x2119, entity=NUMBER, group=CONFIG),
+        RegisterField("grid_max_charge_soc", 0x2117, entity=NUMBER, group=CONFIG),
+        RegisterField("grid_max_charge_power", 0x2116, entity=NUMBER, group=CONFIG),
+        RegisterField("battery_max_charge_power", 0x2118, entity=NUMBER, group=CONFIG),
+        RegisterField("battery_max_power", 0x211A, entity=NUMBER, group=CONFIG),
+        RegisterField("grid_max_feed_in_power", 0x30BA, entity=NUMBER, group=CONFIG),
+        RegisterField("hybrid_work_mode", 0x2100, entity=SELECT, group=CONFIG),
+        RegisterField("eps_enabled", 0x211C, entity=SWITCH, group=CONFIG),
+        RegisterField("battery_voltage", 0x2006, U16, 10),
+        RegisterField("battery_current", 0x2007, S32, 100),
+        RegisterField("grid_voltage", 0x131A, U16, 10),
+        RegisterField("grid_current", 0x131D, S32, 100),
+        RegisterField("mppt1_voltage", 0x1010, U16, 10),
+        RegisterField("mppt1_current", 0x1011, U16, 100),
+        RegisterField("mppt2_voltage", 0x1014, U16, 10),
+        RegisterField("mppt2_current", 0x1015, U16, 100),
+        RegisterField("system_temp", 0x101C, S16),
+        RegisterField(
+            "master_software_version", 0x1A1C, STRING, length=3, group=VERSION
+        ),
+        RegisterField(
+            "slave_software_version", 0x1A26, STRING, length=3, group=VERSION
+        ),
+        RegisterField("ems_software_version", 0x1A60, STRING, length=3, group=VERSION),
+        RegisterField(
+            "dcdc_software_version", 0x1A6F, STRING, length=3, group=VERSION
+        ),
+        # No point in battery temp at 0x2001 as the inverter is always returning zero until Skyline fix it.
+    ]
+)
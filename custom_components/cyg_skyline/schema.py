@@ -0,0 +1,169 @@
+"""Typed clickhouse layout for Skyline stats."""
+
+import hashlib
+import struct
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+
+FLOAT32 = "Float32 CODEC(Gorilla, ZSTD)"
+FLOAT64 = "Float64 CODEC(Gorilla, ZSTD)"
+INT32 = "Int32 CODEC(T64, ZSTD)"
+UINT32 = "UInt32 CODEC(Delta, ZSTD)"
+STRING = "LowCardinality(String)"
+
+KEYFRAME_COLUMN = "keyframe"  # Set in rows holding every value rather than only changes.
+
+DATE_TIME = struct.Struct("<I")
+KEYFRAME = struct.Struct("<B")
+NUMBERS = {
+    FLOAT32: struct.Struct("<f"),
+    FLOAT64: struct.Struct("<d"),
+    INT32: struct.Struct("<i"),
+    UINT32: struct.Struct("<I"),
+}
+
+
+def column_type(entity: SensorEntity) -> str:
+    """Pick the smallest column type that holds a sensor's values without loss."""
+    state_class = entity.state_class
+    decimals = getattr(entity, "decimals", -1)
+
+    if state_class is None and entity.device_class is None:
+        return STRING  # software versions, which barely ever change.
+
+    if state_class in (SensorStateClass.TOTAL, SensorStateClass.TOTAL_INCREASING):
+        # Counters only grow, so store the small deltas between rows.
+        return UINT32 if decimals == 0 else FLOAT64
+
+    return INT32 if decimals == 0 else FLOAT32
+
+
+def encode_string(value: str) -> bytes:
+    """Encode a RowBinary string, prefixed by its length."""
+    data = value.encode("utf-8")
+    return encode_varint(len(data)) + data
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode an unsigned LEB128 length as used by RowBinary strings."""
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value = value >> 7
+        if value == 0:
+            data.append(byte)
+            return bytes(data)
+        data.append(byte | 0x80)
+
+
+class StatsSchema:
+    """The typed columns of the skyline_stats table and how rows are encoded for them."""
+
+    def __init__(self, columns: dict) -> None:
+        """Stats schema initialiser."""
+        self.columns = dict(sorted(columns.items()))
+        self.hash = hashlib.sha256(
+            "\n".join(k + " " + v for k, v in self.columns.items()).encode("utf-8")
+        ).hexdigest()
+        self._encoders = [(k, v, NUMBERS.get(v)) for k, v in self.columns.items()]
+
+    def statements(self) -> list[str]:
+        """DDL bringing the table in line with the schema, safe to repeat."""
+        statements = [
+            "create table if not exists skyline_stats ( at_utc DateTime ) ENGINE = MergeTree PARTITION BY toYYYYMM(at_utc) ORDER BY at_utc;"
+        ]
+        if len(self.columns) > 0:
+            statements.append(
+                "alter table skyline_stats "
+                + ", ".join(
+                    "add column if not exists " + k + " " + v
+                    for k, v in self.columns.items()
+                )
+                + ";"
+            )
+            # Columns created before the layout was typed were all Float64.
+            statements.append(
+                "alter table skyline_stats "
+                + ", ".join(
+                    "modify column " + k + " " + v for k, v in self.columns.items()
+                )
+                + ";"
+            )
+        return statements
+
+    def insert_query(self) -> str:
+        """The insert statement the encoded rows follow."""
+        return (
+            "insert into skyline_stats ( at_utc, "  # noqa: S608
+            + ", ".join(self.columns)
+            + " ) format RowBinary"
+        )
+
+    def encode(self, rows) -> bytes:
+        """Encode (epoch seconds, {column: value}) rows as RowBinary.
+
+        Columns missing from a row are written as zero or empty, as clickhouse does
+        for columns left out of an insert.
+        """
+        data = bytearray()
+        for at, row in rows:
+            data += DATE_TIME.pack(at)
+            for key, column, number in self._encoders:
+                value = row.get(key)
+                if number is None:
+                    data += encode_string("" if value is None else str(value))
+                elif column in (INT32, UINT32):
+                    data += number.pack(0 if value is None else int(round(value)))
+                else:
+                    data += number.pack(0 if value is None else value)
+        return bytes(data)
+
+
+class ChangesSchema:
+    """A narrow table of one row per changed value, in place of one wide row per poll.
+
+    Columns are mapped to the inverter serial and sensor key they came from. Rows
+    flagged as keyframes hold every value, so the state at any time can be rebuilt
+    from the last keyframe before it and the changes since.
+    """
+
+    def __init__(self, columns: dict) -> None:
+        """Changes schema initialiser, columns map to (inverter, key) tuples."""
+        self.columns = {
+            k: (encode_string(inverter), encode_string(key))
+            for k, (inverter, key) in columns.items()
+        }
+        self.hash = hashlib.sha256(
+            "\n".join(self.statements()).encode("utf-8")
+        ).hexdigest()
+
+    def statements(self) -> list[str]:
+        """DDL creating the table, safe to repeat."""
+        return [
+            "create table if not exists skyline_stats_changes ( at_utc DateTime, inverter LowCardinality(String), key LowCardinality(String), value "
+            + FLOAT64
+            + ", text LowCardinality(String), keyframe UInt8 ) ENGINE = MergeTree PARTITION BY toYYYYMM(at_utc) ORDER BY (inverter, key, at_utc);"
+        ]
+
+    def insert_query(self) -> str:
+        """The insert statement the encoded rows follow."""
+        return "insert into skyline_stats_changes ( at_utc, inverter, key, value, text, keyframe ) format RowBinary"
+
+    def encode(self, rows) -> bytes:
+        """Encode (epoch seconds, {column: value}) rows as a RowBinary row per value."""
+        data = bytearray()
+        number = NUMBERS[FLOAT64]
+        for at, row in rows:
+            at = DATE_TIME.pack(at)
+            keyframe = KEYFRAME.pack(1 if row.get(KEYFRAME_COLUMN) else 0)
+            for column, value in row.items():
+                if column not in self.columns:
+                    continue
+                inverter, key = self.columns[column]
+                data += at + inverter + key
+                if isinstance(value, str):
+                    data += number.pack(0) + encode_string(value)
+                else:
+                    data += number.pack(value) + encode_string("")
+                data += keyframe
+        return bytes(data)
@@ -135,7 +135,7 @@ class InverterSelectEntity(SelectEntity):
         self.currentValue = value
 
         self._attr_current_option = value
-        self.async_write_ha_state()
+        self.controller.schedule_state_write(self)
 
     async def async_select_option(self, option: str) -> None:
         """Receive changes from HomeAssistant and push to the inverter."""
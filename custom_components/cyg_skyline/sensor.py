@@ -1,5 +1,6 @@
 """Skyline diagnostics sensors."""
 import logging
+import time
 
 from homeassistant.components.sensor import (
     SensorDeviceClass,
@@ -15,6 +16,7 @@ from homeassistant.const import (
     UnitOfEnergy,
     UnitOfPower,
     UnitOfTemperature,
+    UnitOfTime,
 )
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.entity import generate_entity_id
@@ -514,6 +516,52 @@ async def async_setup_entry(
             stateClass=None,
         )
 
+        controller.sensor_entities[
+            inverter.serial_number + "_modbus_connection"
+        ] = InverterSensorEntity(
+            hass,
+            controller,
+            inverter,
+            "Modbus Connection",
+            "modbus_connection",
+            "mdi:lan-connect",
+            category=EntityCategory.DIAGNOSTIC,
+            deviceClass=None,
+            unitOfMeasurement=None,
+            stateClass=None,
+        )
+
+        controller.sensor_entities[
+            inverter.serial_number + "_modbus_latency"
+        ] = InverterSensorEntity(
+            hass,
+            controller,
+            inverter,
+            "Modbus Latency",
+            "modbus_latency",
+            "mdi:timer-sand",
+            unitOfMeasurement=UnitOfTime.SECONDS,
+            deviceClass=SensorDeviceClass.DURATION,
+            decimals=3,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
+        controller.sensor_entities[
+            inverter.serial_number + "_modbus_errors"
+        ] = InverterSensorEntity(
+            hass,
+            controller,
+            inverter,
+            "Modbus Errors",
+            "modbus_errors",
+            "mdi:lan-disconnect",
+            unitOfMeasurement=None,
+            deviceClass=None,
+            stateClass=SensorStateClass.TOTAL_INCREASING,
+            decimals=0,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
         # No point in the below as the inverter is always returning zero until Skylinefix it.
         # controller.sensor_entities[
         #    inverter.serial_number + "_battery_temp"
@@ -556,6 +604,116 @@ async def async_setup_entry(
         decimals=2,
     )
 
+    controller.sensor_entities["skyline_poll_cycle_duration"] = InverterSensorEntity(
+        hass,
+        controller,
+        None,
+        "Skyline Poll Cycle Duration",
+        "poll_cycle_duration",
+        "mdi:timer-outline",
+        unitOfMeasurement=UnitOfTime.SECONDS,
+        deviceClass=SensorDeviceClass.DURATION,
+        decimals=2,
+        category=EntityCategory.DIAGNOSTIC,
+    )
+
+    controller.sensor_entities["skyline_poll_overruns"] = InverterSensorEntity(
+        hass,
+        controller,
+        None,
+        "Skyline Poll Overruns",
+        "poll_overruns",
+        "mdi:timer-alert-outline",
+        unitOfMeasurement=None,
+        deviceClass=None,
+        stateClass=SensorStateClass.TOTAL_INCREASING,
+        decimals=0,
+        category=EntityCategory.DIAGNOSTIC,
+    )
+
+    controller.sensor_entities["skyline_zero_guard_hits"] = InverterSensorEntity(
+        hass,
+        controller,
+        None,
+        "Skyline Zero Register Reads",
+        "zero_guard_hits",
+        "mdi:numeric-0-box-multiple-outline",
+        unitOfMeasurement=None,
+        deviceClass=None,
+        stateClass=SensorStateClass.TOTAL_INCREASING,
+        decimals=0,
+        category=EntityCategory.DIAGNOSTIC,
+    )
+
+    for sink in controller.stats.sinks:
+        key = "skyline_stats_" + sink.name
+        controller.sensor_entities[key + "_latency"] = InverterSensorEntity(
+            hass,
+            controller,
+            None,
+            "Skyline Stats " + sink.title + " Latency",
+            "stats_" + sink.name + "_latency",
+            "mdi:timer-sand",
+            unitOfMeasurement=UnitOfTime.SECONDS,
+            deviceClass=SensorDeviceClass.DURATION,
+            decimals=3,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
+        controller.sensor_entities[key + "_queue"] = InverterSensorEntity(
+            hass,
+            controller,
+            None,
+            "Skyline Stats " + sink.title + " Queue",
+            "stats_" + sink.name + "_queue",
+            "mdi:tray-full",
+            unitOfMeasurement="rows",
+            deviceClass=None,
+            decimals=0,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
+        controller.sensor_entities[key + "_dropped"] = InverterSensorEntity(
+            hass,
+            controller,
+            None,
+            "Skyline Stats " + sink.title + " Dropped",
+            "stats_" + sink.name + "_dropped",
+            "mdi:tray-remove",
+            unitOfMeasurement="rows",
+            deviceClass=None,
+            stateClass=SensorStateClass.TOTAL_INCREASING,
+            decimals=0,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
+    if controller.clickhouse_writer is not None:
+        controller.sensor_entities["skyline_stats_backlog"] = InverterSensorEntity(
+            hass,
+            controller,
+            None,
+            "Skyline Stats Backlog",
+            "stats_backlog",
+            "mdi:database-clock-outline",
+            unitOfMeasurement="rows",
+            deviceClass=None,
+            decimals=0,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
+        controller.sensor_entities["skyline_stats_replay_rate"] = InverterSensorEntity(
+            hass,
+            controller,
+            None,
+            "Skyline Stats Replay Rate",
+            "stats_replay_rate",
+            "mdi:database-arrow-up-outline",
+            unitOfMeasurement="rows/s",
+            deviceClass=None,
+            decimals=0,
+            category=EntityCategory.DIAGNOSTIC,
+        )
+
     if len(controller.inverters) > 1:
         controller.sensor_entities["skyline_pv_power"] = InverterSensorEntity(
             hass,
@@ -697,16 +855,57 @@ class InverterSensorEntity(SensorEntity):
         if category is not None:
             self._attr_entity_category = category
 
+        self.decimals = decimals
+        self.last_published = float(0)
+        self.latest_value = None  # as read, where the state may be held back by a deadband.
         if decimals >= 0:
             self._attr_suggested_display_precision = decimals
 
-    def set_native_value(self, new_state) -> None:
+    def set_native_value(self, new_state, attributes=None) -> None:
         """Set the HA value from the modbus response."""
-        if self.currentValue is not None and self.currentValue == new_state:
+        self.latest_value = new_state
+
+        if (
+            self.currentValue is not None
+            and self.currentValue == new_state
+            and (
+                attributes is None
+                or attributes == getattr(self, "_attr_extra_state_attributes", None)
+            )
+        ):
             # avoid noise...
             return
 
+        if attributes is None and self.within_deadband(new_state):
+            return
+
         self.currentValue = new_state
+        self.last_published = time.monotonic()
 
         self._attr_native_value = new_state
-        self.async_write_ha_state()
+        if attributes is not None:
+            self._attr_extra_state_attributes = attributes
+        self.controller.schedule_state_write(self)
+
+    def within_deadband(self, new_state) -> bool:
+        """Determine if a change is too small to publish before the heartbeat is due."""
+        deadband = self.controller.sensor_deadbands.get(self._attr_device_class)
+        if (
+            deadband is None
+            or self._attr_state_class != SensorStateClass.MEASUREMENT
+            or self.controller.sensor_heartbeat_seconds <= 0
+            or not isinstance(self.currentValue, (int, float))
+            or not isinstance(new_state, (int, float))
+        ):
+            return False
+
+        if (
+            time.monotonic() - self.last_published
+            >= self.controller.sensor_heartbeat_seconds
+        ):
+            return False
+
+        absolute, percent = deadband
+        return abs(new_state - self.currentValue) < max(
+            absolute, abs(self.currentValue) * percent / 100
+        )
@@ -0,0 +1,228 @@
+"""Append-only on-disk spool for stats rows that couldn't be written."""
+
+import logging
+import os
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+FRAME = struct.Struct(">BI")  # record type, payload length
+COLUMN_ID = struct.Struct(">H")
+ROW_HEADER = struct.Struct(">IH")  # epoch seconds, value count
+VALUE_HEADER = struct.Struct(">HB")  # column id, value type
+NUMBER = struct.Struct(">d")
+TEXT_LENGTH = struct.Struct(">H")
+
+RECORD_COLUMN = 1
+RECORD_ROW = 2
+
+VALUE_NUMBER = 0
+VALUE_TEXT = 1
+
+SEGMENT_SUFFIX = ".spool"
+QUARANTINE_SUFFIX = ".bad"
+
+# What reading a damaged or vanished segment raises.
+SEGMENT_ERRORS = (KeyError, struct.error, UnicodeDecodeError, FileNotFoundError)
+
+
+class Segment:
+    """One spool file and the column dictionary written to it so far."""
+
+    def __init__(self, sequence: int, path: str) -> None:
+        """Segment initialiser."""
+        self.sequence = sequence
+        self.path = path
+        self.rows = 0
+        self.size = 0
+        self.column_ids = {}
+        self.sealed = False
+
+
+class StatsSpool:
+    """Rows are spooled to numbered segment files, each readable on its own.
+
+    Every segment starts its own column dictionary so rows only carry a short id
+    and type per value, which is either a float64 or a short utf-8 string. Rows are
+    appended a batch at a time with a single fsync, and the oldest segments are
+    discarded once the spool outgrows max_bytes. Segments that can't be read are
+    renamed aside rather than stopping the rest being replayed. These methods block
+    on disk IO so should be run in an executor, one at a time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int) -> None:
+        """Stats spool initialiser."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segments = []
+        self.dropped_rows = 0
+        self.is_loaded = False
+
+    @property
+    def rows(self) -> int:
+        """The number of rows waiting in the spool."""
+        return sum(x.rows for x in self.segments)
+
+    @property
+    def size(self) -> int:
+        """The bytes used by the spool."""
+        return sum(x.size for x in self.segments)
+
+    def load(self) -> None:
+        """Find segments left from before a restart."""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                segment = Segment(
+                    int(name[: -len(SEGMENT_SUFFIX)]),
+                    os.path.join(self.directory, name),
+                )
+            except ValueError:
+                continue
+
+            segment.size = os.path.getsize(segment.path)
+            segment.sealed = True  # we've lost its column dictionary, so start another.
+            try:
+                segment.rows = len(self._read(segment))
+            except SEGMENT_ERRORS:
+                self._quarantine(segment)
+                continue
+            self.segments.append(segment)
+
+        self.is_loaded = True
+        if len(self.segments) > 0:
+            _LOGGER.info(
+                "Found %s spooled stats rows in %s segments",
+                self.rows,
+                len(self.segments),
+            )
+
+    def append(self, rows) -> None:
+        """Append (epoch seconds, {column: value}) rows and sync them to disk."""
+        if len(self.segments) == 0 or self.segments[-1].sealed:
+            self._open_segment()
+        segment = self.segments[-1]
+
+        data = bytearray()
+        for at, row in rows:
+            values = bytearray()
+            for column, value in row.items():
+                if column not in segment.column_ids:
+                    column_id = len(segment.column_ids)
+                    segment.column_ids[column] = column_id
+                    name = column.encode("utf-8")
+                    data += FRAME.pack(RECORD_COLUMN, COLUMN_ID.size + len(name))
+                    data += COLUMN_ID.pack(column_id) + name
+                if isinstance(value, str):
+                    text = value.encode("utf-8")
+                    values += VALUE_HEADER.pack(segment.column_ids[column], VALUE_TEXT)
+                    values += TEXT_LENGTH.pack(len(text)) + text
+                else:
+                    values += VALUE_HEADER.pack(
+                        segment.column_ids[column], VALUE_NUMBER
+                    )
+                    values += NUMBER.pack(value)
+
+            data += FRAME.pack(RECORD_ROW, ROW_HEADER.size + len(values))
+            data += ROW_HEADER.pack(at, len(row)) + values
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(segment.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        segment.rows = segment.rows + len(rows)
+        segment.size = segment.size + len(data)
+
+        if segment.size >= self.segment_bytes:
+            segment.sealed = True
+
+        while self.size > self.max_bytes and len(self.segments) > 1:
+            oldest = self.segments.pop(0)
+            self.dropped_rows = self.dropped_rows + oldest.rows
+            _LOGGER.warning(
+                "Stats spool full, dropped %s of the oldest rows", oldest.rows
+            )
+            self._remove(oldest)
+
+    def oldest(self):
+        """Read the rows of the oldest segment, sealing it first if it is still being written."""
+        while len(self.segments) > 0:
+            segment = self.segments[0]
+            segment.sealed = True
+            try:
+                return self._read(segment)
+            except SEGMENT_ERRORS:
+                self.segments.pop(0)
+                self.dropped_rows = self.dropped_rows + segment.rows
+                self._quarantine(segment)
+        return []
+
+    def discard_oldest(self) -> None:
+        """Remove the oldest segment once its rows have been written elsewhere."""
+        if len(self.segments) > 0:
+            self._remove(self.segments.pop(0))
+
+    def _open_segment(self) -> None:
+        sequence = self.segments[-1].sequence + 1 if len(self.segments) > 0 else 1
+        segment = Segment(
+            sequence,
+            os.path.join(self.directory, f"{sequence:010d}{SEGMENT_SUFFIX}"),
+        )
+        self.segments.append(segment)
+
+    def _remove(self, segment: Segment) -> None:
+        try:
+            os.remove(segment.path)
+        except OSError:
+            _LOGGER.error("Unable to remove stats spool segment %s", segment.path)
+
+    def _quarantine(self, segment: Segment) -> None:
+        _LOGGER.exception("Unable to read stats spool segment %s", segment.path)
+        try:
+            os.replace(segment.path, segment.path + QUARANTINE_SUFFIX)
+        except OSError:
+            _LOGGER.error("Unable to set aside stats spool segment %s", segment.path)
+
+    def _read(self, segment: Segment) -> list:
+        with open(segment.path, "rb") as f:
+            data = f.read()
+
+        columns = {}
+        rows = []
+        offset = 0
+        while offset + FRAME.size <= len(data):
+            record_type, length = FRAME.unpack_from(data, offset)
+            offset = offset + FRAME.size
+            if offset + length > len(data):
+                break  # torn write at the end of the file, the rest never made it to disk.
+
+            if record_type == RECORD_COLUMN:
+                (column_id,) = COLUMN_ID.unpack_from(data, offset)
+                columns[column_id] = data[
+                    offset + COLUMN_ID.size : offset + length
+                ].decode("utf-8")
+            elif record_type == RECORD_ROW:
+                at, count = ROW_HEADER.unpack_from(data, offset)
+                row = {}
+                position = offset + ROW_HEADER.size
+                for _ in range(count):
+                    column_id, value_type = VALUE_HEADER.unpack_from(data, position)
+                    position = position + VALUE_HEADER.size
+                    if value_type == VALUE_TEXT:
+                        (text_length,) = TEXT_LENGTH.unpack_from(data, position)
+                        position = position + TEXT_LENGTH.size
+                        value = data[position : position + text_length].decode("utf-8")
+                        position = position + text_length
+                    else:
+                        (value,) = NUMBER.unpack_from(data, position)
+                        position = position + NUMBER.size
+                    row[columns[column_id]] = value
+                rows.append((at, row))
+
+            offset = offset + length
+
+        return rows
@@ -0,0 +1,632 @@
+"""Buffered recording of Skyline stats to external databases."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+import datetime
+import json
+import logging
+import os
+import re
+import time
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    CLICKHOUSE_REPLAY_BATCH_ROWS,
+    DOMAIN,
+    STATS_SINK_BATCH_ROWS,
+    STATS_SINK_FLUSH_INTERVAL_SECONDS,
+    STATS_SINK_MAX_BUFFERED_ROWS,
+    STATS_SINK_SHUTDOWN_SECONDS,
+)
+from .metrics import Histogram
+from .schema import KEYFRAME_COLUMN, ChangesSchema, StatsSchema
+from .spool import StatsSpool
+
+_LOGGER = logging.getLogger(__name__)
+
+METRIC_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+class StatsSink:
+    """A destination for stats rows, buffered and written from its own background task.
+
+    Recording a row never waits on the sink, so a slow or broken sink can't hold up
+    the poll or the other sinks. Rows are written once a batch has built up or the
+    flush interval passes. Failed batches are kept to retry, and once the buffer is
+    full the oldest rows are dropped. Subclasses implement write.
+    """
+
+    name = "sink"
+    title = "Sink"
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        batch_rows=STATS_SINK_BATCH_ROWS,
+        flush_interval_seconds=STATS_SINK_FLUSH_INTERVAL_SECONDS,
+        max_rows=STATS_SINK_MAX_BUFFERED_ROWS,
+    ) -> None:
+        """Stats sink initialiser."""
+        self.hass = hass
+        self.entry = entry
+        self.batch_rows = batch_rows
+        self.flush_interval_seconds = flush_interval_seconds
+        self.rows = deque(maxlen=max_rows)
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.latency = Histogram()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._started = False
+        self._stopping = False
+
+    def record(self, row: dict) -> None:
+        """Queue a row of column values to be written with the current time."""
+        if len(self.rows) == self.rows.maxlen:
+            self.dropped_rows = self.dropped_rows + 1
+            if self.dropped_rows % 100 == 1:
+                _LOGGER.warning(
+                    "%s stats buffer full, %s rows dropped so far",
+                    self.title,
+                    self.dropped_rows,
+                )
+
+        self.rows.append((int(time.time()), row))
+
+        if self._task is None and not self._stopping:
+            self._task = self.entry.async_create_background_task(
+                self.hass, self._run(), "Skyline " + self.title + " Stats Writer"
+            )
+
+        if len(self.rows) >= self.batch_rows:
+            self._wake.set()
+
+    def terminate(self) -> None:
+        """Stop the background flush."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def shutdown(self, timeout: float) -> None:
+        """Stop the background flush and write out what's buffered, keeping what can't be."""
+        task = self._task
+        self._task = None
+        self._stopping = True
+
+        try:
+            await asyncio.wait_for(self.stop(task), timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warning("Timed out writing the last stats to %s", self.title)
+        except asyncio.CancelledError:
+            raise
+        except:  # noqa: E722
+            _LOGGER.exception("Unable to write the last stats to %s", self.title)
+
+        if len(self.rows) > 0:
+            rows = list(self.rows)
+            self.rows.clear()
+            await self.abandon(rows)
+
+    async def stop(self, task) -> None:
+        """Let the background flush finish any write it's part way through, then drain."""
+        if task is not None:
+            self._wake.set()
+            await task
+        if len(self.rows) > 0:
+            await self.drain()
+
+    async def drain(self) -> None:
+        """Write every buffered row, stopping at the first failure."""
+        await self.ensure_started()
+        while len(self.rows) > 0:
+            if await self.flush() is False:
+                return
+
+    async def abandon(self, rows) -> None:
+        """Deal with rows left unwritten at shutdown, which without a spool are lost."""
+        _LOGGER.warning("Lost %s stats rows for %s at shutdown", len(rows), self.title)
+
+    async def ensure_started(self) -> None:
+        """Prepare the sink, unless that's been done already."""
+        if not self._started:
+            await self.start()
+            self._started = True
+
+    async def start(self) -> None:
+        """Prepare the sink before the first flush."""
+
+    async def write(self, batch) -> bool:
+        """Write (epoch seconds, {column: value}) rows, returning False if they weren't."""
+        raise NotImplementedError
+
+    async def failed(self, batch) -> None:
+        """Keep a batch that couldn't be written to retry next time."""
+        # Put them back, dropping the oldest if new rows filled the gap.
+        space = self.rows.maxlen - len(self.rows)
+        if space < len(batch):
+            self.dropped_rows = self.dropped_rows + len(batch) - space
+            batch = batch[len(batch) - space :]
+        self.rows.extendleft(reversed(batch))
+
+    async def flushed(self, written: bool | None) -> None:
+        """Called after each flush, written is None if there was nothing to write."""
+
+    async def _run(self):
+        try:
+            await self.ensure_started()
+        except asyncio.CancelledError:
+            raise
+        except:  # noqa: E722
+            _LOGGER.exception("Unable to start writing stats to %s", self.title)
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                return
+
+            try:
+                await self.ensure_started()
+
+                written = None
+                while len(self.rows) > 0 and not self._stopping:
+                    written = await self.flush()
+                    if written is False or len(self.rows) < self.batch_rows:
+                        break
+
+                await self.flushed(written)
+            except asyncio.CancelledError:
+                raise
+            except:  # noqa: E722
+                # Carry on, as rows keep being buffered for this task to write.
+                _LOGGER.exception("Unable to write stats to %s", self.title)
+
+    async def flush(self) -> bool:
+        """Write a batch of buffered rows, returning False if the sink rejected it."""
+        batch = []
+        while len(self.rows) > 0 and len(batch) < self.batch_rows:
+            batch.append(self.rows.popleft())
+
+        if len(batch) == 0:
+            return True
+
+        started = time.monotonic()
+        try:
+            written = await self.write(batch)
+        except asyncio.CancelledError:
+            # An executor write carries on regardless, so putting the batch back
+            # could write it twice. Shutdown waits for writes rather than cancel them.
+            raise
+        except:  # noqa: E722
+            _LOGGER.exception("Unable to write stats to %s", self.title)
+            written = False
+        self.latency.observe(time.monotonic() - started)
+
+        if written:
+            self.written_rows = self.written_rows + len(batch)
+            return True
+
+        await self.failed(batch)
+        return False
+
+    @property
+    def backlog_rows(self) -> int:
+        """Rows waiting to be written."""
+        return len(self.rows)
+
+
+class StatsPipeline:
+    """Fans stats rows out to every configured sink."""
+
+    def __init__(self) -> None:
+        """Stats pipeline initialiser."""
+        self.sinks = []
+
+    def add(self, sink: StatsSink) -> None:
+        """Add a sink to receive every row recorded from now on."""
+        self.sinks.append(sink)
+
+    def record(self, row: dict) -> None:
+        """Queue a row with every sink."""
+        for sink in self.sinks:
+            sink.record(row)
+
+    def terminate(self) -> None:
+        """Stop every sink."""
+        for sink in self.sinks:
+            sink.terminate()
+
+    async def shutdown(self) -> None:
+        """Stop every sink, writing out their buffered rows together."""
+        await asyncio.gather(
+            *[x.shutdown(STATS_SINK_SHUTDOWN_SECONDS) for x in self.sinks]
+        )
+
+
+class ClickhouseWriter(StatsSink):
+    """Inserts stats rows to clickhouse, spooling them to disk while it's unreachable.
+
+    If an insert fails the batch goes to the spool, if there is one, and is replayed
+    in large batches once clickhouse is back. Batches clickhouse rejects outright,
+    with a client error, are dropped rather than retried forever, once the schema
+    has been applied again in case the table went missing. Rows are inserted as RowBinary in the
+    typed layout of the schema, made once the sensors exist. The hash of the last
+    schema applied is kept in HA storage so the DDL only runs when it changes.
+    """
+
+    name = "clickhouse"
+    title = "Clickhouse"
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        url: str,
+        schema_factory,
+        changes: ChangeTracker | None = None,
+        spool: StatsSpool | None = None,
+    ) -> None:
+        """Clickhouse writer initialiser."""
+        super().__init__(hass, entry)
+        self.url = url
+        self.schema_factory = schema_factory
+        self.schema: StatsSchema | ChangesSchema | None = None
+        self.changes = changes
+        self.spool = spool
+        self.replayed_rows = 0
+        self.replay_rows_per_second = float(0)
+        self._replay_offset = 0
+        self.session = None
+        self.store = Store(hass, 1, DOMAIN + "_stats_schema")
+        self.applied_schema = None
+        self.rejected = False
+
+    def record(self, row: dict) -> None:
+        """Queue a row, or only its changes in the change-only layout."""
+        if self.changes is not None:
+            row = self.changes.changes(row)
+            if len(row) == 0:
+                return
+        super().record(row)
+
+    async def start(self) -> None:
+        """Make the schema and pick up the spool and the last schema applied."""
+        self.schema = self.schema_factory()
+
+        stored = await self.store.async_load()
+        if stored is not None and stored.get("url") == self.url:
+            self.applied_schema = stored.get("hash")
+
+        if self.spool is not None and not self.spool.is_loaded:
+            try:
+                await self.hass.async_add_executor_job(self.spool.load)
+            except OSError:
+                _LOGGER.exception("Unable to use the stats spool")
+                self.spool = None
+
+    async def write(self, batch) -> bool:
+        """Insert a batch of rows."""
+        return await self.insert(batch)
+
+    async def abandon(self, rows) -> None:
+        """Spool rows left unwritten at shutdown, to be replayed after the next start."""
+        if self.spool is None:
+            await super().abandon(rows)
+            return
+
+        try:
+            if not self.spool.is_loaded:
+                await self.hass.async_add_executor_job(self.spool.load)
+            await self.hass.async_add_executor_job(self.spool.append, rows)
+        except OSError:
+            _LOGGER.exception("Unable to spool stats rows")
+
+    async def failed(self, batch) -> None:
+        """Spool a batch that couldn't be inserted, or keep it in memory without a spool."""
+        if self.rejected:
+            # Clickhouse will never take it, so retrying would only hold up the rows behind.
+            self.dropped_rows = self.dropped_rows + len(batch)
+            _LOGGER.error("Clickhouse rejected %s stats rows, dropped them", len(batch))
+            return
+
+        if self.spool is not None:
+            try:
+                await self.hass.async_add_executor_job(self.spool.append, batch)
+                return
+            except OSError:
+                _LOGGER.exception("Unable to spool stats rows")
+
+        await super().failed(batch)
+
+    async def flushed(self, written: bool | None) -> None:
+        """Replay the spool once clickhouse is taking inserts again."""
+        if self.spool is None or self.spool.rows == 0 or written is False:
+            return
+
+        if written is None and await self.insert([]) is False:
+            # nothing new was written, so check clickhouse is back first.
+            return
+
+        await self.replay()
+
+    async def replay(self):
+        """Write spooled rows oldest first, stopping if clickhouse fails again."""
+        started = time.monotonic()
+        replayed = 0
+        while self.spool.rows > 0 and not self._stopping:
+            segment = self.spool.segments[0]
+            rows = await self.hass.async_add_executor_job(self.spool.oldest)
+            if self.spool.segments[:1] != [segment]:
+                self._replay_offset = 0  # it couldn't be read so was set aside.
+            while self._replay_offset < len(rows) and not self._stopping:
+                batch = rows[
+                    self._replay_offset : self._replay_offset
+                    + CLICKHOUSE_REPLAY_BATCH_ROWS
+                ]
+                if await self.insert(batch) is False:
+                    if not self.rejected:
+                        self.publish_replay_rate(replayed, started)
+                        return
+                    self.dropped_rows = self.dropped_rows + len(batch)
+                    _LOGGER.error(
+                        "Clickhouse rejected %s spooled stats rows, dropped them",
+                        len(batch),
+                    )
+                    self._replay_offset = self._replay_offset + len(batch)
+                    continue
+                self._replay_offset = self._replay_offset + len(batch)
+                replayed = replayed + len(batch)
+
+            if self._replay_offset < len(rows):
+                break  # stopping, the rest is replayed after the next start.
+
+            await self.hass.async_add_executor_job(self.spool.discard_oldest)
+            self._replay_offset = 0
+
+        self.publish_replay_rate(replayed, started)
+        _LOGGER.info("Replayed %s spooled stats rows", replayed)
+
+    def publish_replay_rate(self, replayed: int, started: float):
+        """Record how quickly rows were replayed from the spool."""
+        self.replayed_rows = self.replayed_rows + replayed
+        elapsed = time.monotonic() - started
+        if replayed > 0 and elapsed > 0:
+            self.replay_rows_per_second = replayed / elapsed
+
+    @property
+    def backlog_rows(self) -> int:
+        """Rows waiting to be written, in memory and spooled."""
+        spooled = 0 if self.spool is None else self.spool.rows - self._replay_offset
+        return len(self.rows) + spooled
+
+    async def insert(self, batch) -> bool:
+        """Insert rows, or just check clickhouse is reachable if there are none."""
+        if len(batch) == 0:
+            return await self.execute("select 1")
+
+        data = self.schema.encode(batch)
+        if not await self.ensure_schema():
+            return False
+        if await self.execute(self.schema.insert_query(), data):
+            return True
+        if not self.rejected:
+            return False
+
+        # The table or a column may have gone since the schema was applied, so apply
+        # it again and retry once before the batch is given up on.
+        _LOGGER.warning("Clickhouse rejected an insert, applying the stats schema again")
+        self.applied_schema = None
+        await self.store.async_remove()
+        return await self.ensure_schema() and await self.execute(
+            self.schema.insert_query(), data
+        )
+
+    async def ensure_schema(self) -> bool:
+        """Create or alter the table if the schema has changed since it was last applied."""
+        if self.applied_schema == self.schema.hash:
+            return True
+
+        for statement in self.schema.statements():
+            if await self.execute(statement) is False:
+                return False
+
+        _LOGGER.info("Applied clickhouse stats schema %s", self.schema.hash[:12])
+        self.applied_schema = self.schema.hash
+        await self.store.async_save({"url": self.url, "hash": self.schema.hash})
+        return True
+
+    async def execute(self, cmd: str, data: bytes | None = None) -> bool:
+        """Execute a statement to the clickhouse database, with any data for it in the body."""
+        if self.session is None:
+            self.session = async_get_clientsession(self.hass)
+
+        self.rejected = False
+        try:
+            if data is None:
+                x = await self.session.post(self.url, data=cmd)
+            else:
+                x = await self.session.post(self.url, params={"query": cmd}, data=data)
+
+            if x.status != 200:
+                _LOGGER.error(
+                    "Clickhouse command failed: %s %s", cmd[:200], await x.text()
+                )
+                # Client errors, bar timeouts and throttling, won't go away on retry.
+                self.rejected = 400 <= x.status < 500 and x.status not in (408, 429)
+                return False
+        except asyncio.CancelledError:
+            raise
+        except:  # noqa: E722
+            _LOGGER.error("Clickhouse command failed: %s", cmd[:200])
+            return False
+
+        return True
+
+
+class ChangeTracker:
+    """Reduces full rows to the values that changed since the last one written.
+
+    Every keyframe_seconds the whole row is passed through and flagged as a keyframe.
+    """
+
+    def __init__(self, keyframe_seconds: int) -> None:
+        """Change tracker initialiser."""
+        self.keyframe_seconds = keyframe_seconds
+        self.last = {}
+        self.last_keyframe = None
+
+    def changes(self, row: dict, at=None) -> dict:
+        """Get the changed values of a row, or every value if a keyframe is due."""
+        at = time.monotonic() if at is None else at
+        if (
+            self.last_keyframe is None
+            or at - self.last_keyframe >= self.keyframe_seconds
+        ):
+            self.last_keyframe = at
+            self.last = dict(row)
+            return {**row, KEYFRAME_COLUMN: 1}
+
+        changed = {}
+        for k, v in row.items():
+            if k not in self.last or self.last[k] != v:
+                changed[k] = v
+                self.last[k] = v
+        return changed
+
+
+class InfluxSink(StatsSink):
+    """Writes stats rows to InfluxDB as line protocol over HTTP."""
+
+    name = "influx"
+    title = "InfluxDB"
+
+    def __init__(
+        self, hass: HomeAssistant, entry: ConfigEntry, url: str, token=""
+    ) -> None:
+        """InfluxDB sink initialiser, the url being the v1 or v2 write endpoint."""
+        super().__init__(hass, entry)
+        self.url = url
+        self.headers = {}
+        if token is not None and len(token) > 0:
+            self.headers["Authorization"] = "Token " + token
+        self.session = None
+
+    async def write(self, batch) -> bool:
+        """Post a batch of rows as one line per row."""
+        if self.session is None:
+            self.session = async_get_clientsession(self.hass)
+
+        lines = []
+        for at, row in batch:
+            fields = ",".join(
+                escape_influx_key(k) + "=" + influx_value(v) for k, v in row.items()
+            )
+            if len(fields) > 0:
+                lines.append("skyline_stats " + fields + " " + str(at))
+
+        x = await self.session.post(
+            self.url,
+            params={"precision": "s"},
+            data="\n".join(lines),
+            headers=self.headers,
+        )
+        if x.status not in (200, 204):
+            _LOGGER.error("InfluxDB write failed: %s", await x.text())
+            return False
+        return True
+
+
+def escape_influx_key(key: str) -> str:
+    """Escape a line protocol field key."""
+    return (
+        key.replace("\\", "\\\\")
+        .replace(",", "\\,")
+        .replace("=", "\\=")
+        .replace(" ", "\\ ")
+    )
+
+
+def influx_value(value) -> str:
+    """Format a line protocol field value."""
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return repr(float(value))
+
+
+class FileSink(StatsSink):
+    """Appends stats rows to a JSON lines file per UTC day."""
+
+    name = "file"
+    title = "File"
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, directory: str) -> None:
+        """File sink initialiser."""
+        super().__init__(hass, entry)
+        self.directory = directory
+
+    async def write(self, batch) -> bool:
+        """Append a batch of rows from the executor."""
+        await self.hass.async_add_executor_job(self.append, batch)
+        return True
+
+    def append(self, batch) -> None:
+        """Append rows to the file for their day."""
+        os.makedirs(self.directory, exist_ok=True)
+        files = {}
+        for at, row in batch:
+            day = datetime.datetime.fromtimestamp(at, datetime.timezone.utc)
+            files.setdefault(day.strftime("%Y%m%d"), []).append(
+                json.dumps({"at_utc": at, **row}, separators=(",", ":"))
+            )
+
+        for day, lines in files.items():
+            with open(
+                os.path.join(self.directory, "skyline_stats_" + day + ".jsonl"),
+                "a",
+                encoding="utf-8",
+            ) as f:
+                f.write("\n".join(lines) + "\n")
+
+
+class PushgatewaySink(StatsSink):
+    """Pushes the latest stats to a Prometheus pushgateway.
+
+    The pushgateway only keeps the last value of each metric, so of each batch only
+    the newest row is pushed.
+    """
+
+    name = "pushgateway"
+    title = "Pushgateway"
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, url: str) -> None:
+        """Pushgateway sink initialiser, the url being that of the job to push to."""
+        super().__init__(hass, entry, batch_rows=1, flush_interval_seconds=60)
+        self.url = url
+        self.session = None
+
+    async def write(self, batch) -> bool:
+        """Replace the job's metrics with those of the newest row."""
+        if self.session is None:
+            self.session = async_get_clientsession(self.hass)
+
+        _, row = batch[-1]
+        body = "".join(
+            "skyline_" + METRIC_NAME.sub("_", k) + " " + repr(float(v)) + "\n"
+            for k, v in row.items()
+            if not isinstance(v, str)
+        )
+        x = await self.session.put(self.url, data=body)
+        if x.status not in (200, 202):
+            _LOGGER.error("Pushgateway push failed: %s", await x.text())
+            return False
+        return True
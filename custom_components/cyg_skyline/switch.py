@@ -132,7 +132,7 @@ class InverterSwitchEntity(SwitchEntity):
 
         # self._attr_current_option = new_value
 
-        self.async_write_ha_state()
+        self.controller.schedule_state_write(self)
         self.currentValue = new_value
 
     async def async_turn_on(self, **kwargs) -> None:
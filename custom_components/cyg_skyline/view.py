@@ -0,0 +1,32 @@
+"""HTTP view serving Skyline metrics for scraping."""
+
+from aiohttp import web
+
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .metrics import OPENMETRICS_CONTENT_TYPE
+
+
+class SkylineMetricsView(HomeAssistantView):
+    """Serves the pre-rendered OpenMetrics exposition of the current controller."""
+
+    url = "/api/" + DOMAIN + "/metrics"
+    name = "api:" + DOMAIN + ":metrics"
+    requires_auth = True
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Metrics view initialiser."""
+        self.hass = hass
+
+    async def get(self, request: web.Request) -> web.Response:
+        """Return the latest metrics."""
+        controller = self.hass.data[DOMAIN].get("controller")
+        if controller is None:
+            return web.Response(status=503)
+
+        return web.Response(
+            body=controller.exposition.render(),
+            headers={"Content-Type": OPENMETRICS_CONTENT_TYPE},
+        )
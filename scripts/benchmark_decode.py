@@ -0,0 +1,95 @@
+"""Time decoding one inverter poll, per value as it used to be and with the compiled decoder.
+
+Run from the repository root with Home Assistant installed:
+
+    python scripts/benchmark_decode.py
+"""
+
+import pathlib
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from custom_components.cyg_skyline.registers import (  # noqa: E402
+    INVERTER_REGISTERS,
+    S16,
+    S32,
+    STRING,
+    U32,
+    RegisterView,
+)
+
+ROUNDS = 20000
+
+
+def registers_to_signed_32(registers, pos):
+    """Convert a section of registers into a signed 32."""
+    regs = [registers[pos], registers[pos + 1]]
+    b = struct.pack(">2H", *regs)
+    return struct.unpack(">l", b)[0]
+
+
+def register_to_signed_16(register):
+    """Convert a section of registers into a signed 16."""
+    b = struct.pack(">H", register)
+    return struct.unpack(">h", b)[0]
+
+
+def registers_to_unsigned_32(registers, pos):
+    """Convert a section of registers into a unsigned 32."""
+    regs = [registers[pos], registers[pos + 1]]
+    b = struct.pack(">2H", *regs)
+    return struct.unpack(">L", b)[0]
+
+
+def decode_per_value(view: RegisterView, fields) -> dict:
+    """Decode every field one value at a time, packing and unpacking each."""
+    values = {}
+    for field in fields:
+        value = 0
+        for address in field.addresses:
+            registers = view.registers(address, field.words)
+            if field.data_type == U32:
+                value = value + registers_to_unsigned_32(registers, 0)
+            elif field.data_type == S32:
+                value = value + registers_to_signed_32(registers, 0)
+            elif field.data_type == S16:
+                value = value + register_to_signed_16(registers[0])
+            else:
+                value = value + registers[0]
+
+        if field.scale != 1:
+            value = value / field.scale
+
+        values[field.key] = value
+
+    return values
+
+
+def main() -> None:
+    """Check both decodes agree on random registers, then time them."""
+    fields = [x for x in INVERTER_REGISTERS.fields if x.data_type != STRING]
+    decoder = INVERTER_REGISTERS.decoder_for(
+        [address for x in fields for address in x.addresses]
+    )
+
+    view = RegisterView()
+    for block in decoder.plan:
+        view.add(block.start, [random.randrange(0x10000) for _ in range(block.count)])
+
+    before = decode_per_value(view, fields)
+    after = decoder.decode(view)
+    assert before == {x.key: after[x.key] for x in fields}, (before, after)
+
+    before_us = timeit.timeit(lambda: decode_per_value(view, fields), number=ROUNDS)
+    after_us = timeit.timeit(lambda: decoder.decode(view), number=ROUNDS)
+    print(f"{len(fields)} fields, {len(decoder.plan)} blocks, {ROUNDS} rounds")
+    print(f"per value decode: {before_us / ROUNDS * 1e6:.1f} us per inverter per poll")
+    print(f"compiled decode:  {after_us / ROUNDS * 1e6:.1f} us per inverter per poll")
+
+
+if __name__ == "__main__":
+    main()